@@ -0,0 +1,111 @@
+import time
+from threading import Lock
+
+import google.auth.transport.requests
+import google.oauth2.id_token
+import requests
+from google.auth import jwt
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class CallbackRetry(Retry):
+    """
+    Retry that only resends a non-idempotent request (POST/PATCH) on a 503, which the
+    load balancer answers without reaching the backend. A 502/504 may come after the
+    backend applied the write, and the callbacks are not idempotent (they increment
+    daily usage and emailsSentCount), so those are only retried for idempotent methods.
+    """
+
+    IDEMPOTENT_METHODS = frozenset({'GET', 'PUT', 'DELETE'})
+    NON_IDEMPOTENT_STATUS_FORCELIST = frozenset({503})
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() not in self.IDEMPOTENT_METHODS and status_code not in self.NON_IDEMPOTENT_STATUS_FORCELIST:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class BackendClient:
+    """
+    Client for the callbacks sent to the Next.js backend (`/api/internal/...`).
+
+    The ID token is fetched from the metadata server once and reused until it gets close
+    to its `exp`. Requests go through a single keep-alive `requests.Session`, so a burst
+    of callbacks shares pooled TLS connections instead of opening one each.
+
+    Only failures that happen before the backend could have applied the request are
+    retried: connection errors, and 503 from the load balancer (plus 502/504 for
+    idempotent methods, see CallbackRetry). Read timeouts are not, since the write may
+    already have gone through.
+    """
+
+    def __init__(self, base_url, audience, use_id_token=True, token_refresh_margin_seconds=300,
+                 pool_maxsize=10, max_retries=3, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.audience = audience
+        self.use_id_token = use_id_token
+        self.token_refresh_margin_seconds = token_refresh_margin_seconds
+        self.timeout = timeout
+
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = Lock()
+
+        retry = CallbackRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET', 'POST', 'PATCH', 'PUT', 'DELETE'}),
+            backoff_factor=0.5,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def _id_token(self):
+        with self._token_lock:
+            if self._token and time.time() < self._token_expires_at - self.token_refresh_margin_seconds:
+                return self._token
+
+            auth_req = google.auth.transport.requests.Request()
+            # Just works for service accounts or in the cloud. Locally, I need to login impersonating a service account.
+            token = google.oauth2.id_token.fetch_id_token(auth_req, self.audience)
+
+            claims = jwt.decode(token, verify=False)
+            self._token = token
+            self._token_expires_at = claims.get('exp', 0)
+            return token
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token = None
+            self._token_expires_at = 0
+
+    def request(self, method, path, body=None) -> requests.Response:
+        headers = {}
+        if self.use_id_token:
+            headers["Authorization"] = f"Bearer {self._id_token()}"
+
+        response = self.session.request(method, f"{self.base_url}{path}", json=body, headers=headers, timeout=self.timeout)
+
+        if response.status_code == 401 and self.use_id_token:
+            # The token may have been revoked or the clock skewed, try once with a new one
+            self.invalidate_token()
+            headers["Authorization"] = f"Bearer {self._id_token()}"
+            response = self.session.request(method, f"{self.base_url}{path}", json=body, headers=headers, timeout=self.timeout)
+
+        response.raise_for_status()
+        return response
+
+    def patch(self, path, body=None) -> requests.Response:
+        return self.request('PATCH', path, body)
+
+    def post(self, path, body=None) -> requests.Response:
+        return self.request('POST', path, body)
@@ -0,0 +1,157 @@
+"""
+Micro-benchmark of the Liquid value types (liquid_types.py).
+
+Compares the current LiquidFloat/LiquidDate with the previous __dict__-based versions
+(kept below as reference) on memory per instance, construction time and the render time
+of a math-heavy template, and checks that both render the same text.
+
+Run from the generate-pdfs directory:
+
+    python benchmarks/liquid_types_benchmark.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from liquid import Environment
+from liquid_types import LiquidDate, LiquidFloat, liquid_environment, make_math_filters
+
+N_INSTANCES = 100_000
+N_RENDERS = 2_000
+NUMBERS = ['7,5', '1.234,56', '12.345', '1,000,000', '3', '98.7', '0,25', '15.000.000']
+
+TEMPLATE = """
+{%- assign total = 0 -%}
+{%- for nota in notas -%}
+  {%- assign total = total | plus: nota -%}
+  {{ nota | times: 1000 }} / {{ nota | divided_by: 3 | round: 2 }} /
+{%- endfor -%}
+{{ total }} {{ total | divided_by: notas.size | round: 2 }} {{ data }}
+"""
+
+
+class LegacyLiquidDate(datetime):
+    def __new__(cls, display, dt_obj):
+        obj = datetime.__new__(cls, dt_obj.year, dt_obj.month, dt_obj.day, dt_obj.hour, dt_obj.minute, dt_obj.second)
+        obj.display = display
+        return obj
+
+    def __str__(self):
+        return self.display
+
+
+class LegacyLiquidFloat(float):
+    def __new__(cls, display_value, _math_value=None, _dec_sep=None, _thousands_sep=None):
+        if _math_value is not None:
+            obj = float.__new__(cls, _math_value)
+            obj.display, obj.dec_sep, obj.thousands_sep = display_value, _dec_sep, _thousands_sep
+            obj._decimal = Decimal(str(_math_value))
+            return obj
+
+        cleaned = str(display_value).strip()
+        last_dot, last_comma = cleaned.rfind('.'), cleaned.rfind(',')
+        dec_sep, thousands_sep = '.', None
+        if last_comma > last_dot:
+            if last_dot == -1 and cleaned.count(',') > 1:
+                dec_sep, thousands_sep = '.', ','
+                cleaned = cleaned.replace(',', '')
+            else:
+                dec_sep, thousands_sep = ',', '.'
+                cleaned = cleaned.replace('.', '').replace(',', '.')
+        elif last_dot > last_comma:
+            if last_comma == -1 and (cleaned.count('.') > 1 or len(cleaned.split('.')[1]) == 3):
+                dec_sep, thousands_sep = ',', '.'
+                cleaned = cleaned.replace('.', '')
+            else:
+                dec_sep, thousands_sep = '.', ','
+                cleaned = cleaned.replace(',', '')
+
+        obj = float.__new__(cls, float(cleaned))
+        obj.display = display_value
+        obj.dec_sep = dec_sep
+        obj.thousands_sep = thousands_sep
+        obj._decimal = Decimal(cleaned)
+        return obj
+
+    def _reformat(self, decimal_value):
+        d_str = f"{decimal_value:f}"
+        if '.' in d_str:
+            int_raw, dec_raw = d_str.lstrip('-').split('.')
+            dec_raw = dec_raw.rstrip('0') or None
+        else:
+            int_raw = d_str.lstrip('-')
+            dec_raw = None
+
+        int_part = self._apply_thousands(int_raw, self.thousands_sep) if self.thousands_sep else int_raw
+        prefix = '-' if decimal_value < 0 else ''
+        display = f"{prefix}{int_part}{self.dec_sep}{dec_raw}" if dec_raw else f"{prefix}{int_part}"
+
+        result = LegacyLiquidFloat.__new__(LegacyLiquidFloat, display,
+            _math_value=float(decimal_value), _dec_sep=self.dec_sep, _thousands_sep=self.thousands_sep)
+        result._decimal = decimal_value
+        return result
+
+    @staticmethod
+    def _apply_thousands(int_str, sep):
+        parts = []
+        for i, d in enumerate(reversed(int_str)):
+            if i > 0 and i % 3 == 0:
+                parts.append(sep)
+            parts.append(d)
+        return ''.join(reversed(parts))
+
+    def __str__(self):
+        return str(self.display)
+
+
+def bytes_per_instance(factory):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [factory(i) for i in range(N_INSTANCES)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del instances
+    return (after - before) / N_INSTANCES
+
+
+def build_context(float_type, date_type):
+    return {
+        "notas": [float_type(n) for n in NUMBERS],
+        "data": date_type('25/12/2024', datetime(2024, 12, 25)),
+    }
+
+
+def main():
+    legacy_environment = Environment()
+    for name, fn in make_math_filters(LegacyLiquidFloat).items():
+        legacy_environment.add_filter(name, fn)
+
+    cases = {
+        'legacy': (LegacyLiquidFloat, LegacyLiquidDate, legacy_environment),
+        'current': (LiquidFloat, LiquidDate, liquid_environment),
+    }
+
+    outputs = {}
+    for label, (float_type, date_type, environment) in cases.items():
+        template = environment.from_string(TEMPLATE)
+        outputs[label] = template.render(**build_context(float_type, date_type))
+
+        float_bytes = bytes_per_instance(lambda i: float_type(NUMBERS[i % len(NUMBERS)]))
+        date_bytes = bytes_per_instance(lambda i: date_type('25/12/2024', datetime(2024, 12, 25)))
+        construct = timeit.timeit(lambda: [float_type(n) for n in NUMBERS], number=N_INSTANCES // len(NUMBERS))
+        render = timeit.timeit(lambda: template.render(**build_context(float_type, date_type)), number=N_RENDERS)
+
+        print(f"{label:>8}: LiquidFloat {float_bytes:6.1f} B/instance, LiquidDate {date_bytes:6.1f} B/instance, "
+              f"{N_INSTANCES} constructions {construct * 1000:7.1f} ms, {N_RENDERS} renders {render * 1000:7.1f} ms")
+
+    assert outputs['legacy'] == outputs['current'], "Rendering differs from the legacy types"
+    print("Rendered output is identical:", repr(outputs['current'].strip()))
+
+
+if __name__ == '__main__':
+    main()
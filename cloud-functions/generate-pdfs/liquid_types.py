@@ -1,8 +1,11 @@
-from decimal import Decimal, ROUND_HALF_UP, ROUND_CEILING, ROUND_FLOOR, localcontext
+from decimal import Context, Decimal, ROUND_HALF_UP, ROUND_CEILING, ROUND_FLOOR
+from functools import lru_cache
 from datetime import datetime
 from liquid import Environment
 
 class LiquidDate(datetime):
+    __slots__ = ('display',)
+
     # The __new__ intercepts the creation. We receive a string (display) and the datetime object
     def __new__(cls, display, dt_obj):
         # We feed the super class (datetime) with the integer numbers she needs
@@ -23,12 +26,16 @@ class LiquidDate(datetime):
         return self.display
 
 class LiquidFloat(float):
+    # Fixed attributes instead of a per-instance __dict__. The Decimal used by the math
+    # filters is only built on first access, from the text it was parsed from.
+    __slots__ = ('display', 'dec_sep', 'thousands_sep', '_decimal_value', '_decimal_source')
+
     def __new__(cls, display_value, _math_value=None, _dec_sep=None, _thousands_sep=None):
         # 1. Early Return: if we already passed a mathematical value, construct and return immediately
         if _math_value is not None:
             obj = float.__new__(cls, _math_value)
             obj.display, obj.dec_sep, obj.thousands_sep = display_value, _dec_sep, _thousands_sep
-            obj._decimal = Decimal(str(_math_value))
+            obj._decimal_value, obj._decimal_source = None, _math_value
             return obj
 
         # 2. Parsing Logic (when we only receive the string)
@@ -64,10 +71,20 @@ class LiquidFloat(float):
         obj.display = display_value
         obj.dec_sep = dec_sep
         obj.thousands_sep = thousands_sep
-        obj._decimal = Decimal(cleaned)
+        obj._decimal_value, obj._decimal_source = None, cleaned
         
         return obj
 
+    @property
+    def _decimal(self):
+        if self._decimal_value is None:
+            self._decimal_value = Decimal(str(self._decimal_source))
+        return self._decimal_value
+
+    @_decimal.setter
+    def _decimal(self, value):
+        self._decimal_value = value
+
     def _reformat(self, decimal_value):
         d_str = f"{decimal_value:f}"
         if '.' in d_str:
@@ -81,26 +98,36 @@ class LiquidFloat(float):
         prefix = '-' if decimal_value < 0 else ''
         display = f"{prefix}{int_part}{self.dec_sep}{dec_raw}" if dec_raw else f"{prefix}{int_part}"
 
-        result = LiquidFloat.__new__(LiquidFloat, display,
-            _math_value=float(decimal_value), _dec_sep=self.dec_sep, _thousands_sep=self.thousands_sep)
-        result.display = display
-        result._decimal = decimal_value
+        result = float.__new__(LiquidFloat, decimal_value)
+        result.display, result.dec_sep, result.thousands_sep = display, self.dec_sep, self.thousands_sep
+        result._decimal_value, result._decimal_source = decimal_value, decimal_value
         return result
 
     @staticmethod
     def _apply_thousands(int_str, sep):
-        parts = []
-        for i, d in enumerate(reversed(int_str)):
-            if i > 0 and i % 3 == 0:
-                parts.append(sep)
-            parts.append(d)
-        return ''.join(reversed(parts))
+        if len(int_str) <= 3:
+            return int_str
+        head = len(int_str) % 3 or 3
+        return sep.join([int_str[:head]] + [int_str[i:i + 3] for i in range(head, len(int_str), 3)])
 
     def __str__(self):
         return str(self.display)
 
 DIVIDED_BY_PRECISION = 8
 
+# LiquidFloat/int arithmetic skips the filters' type dispatch and mixes the int straight
+# into the Decimal (exactly like Decimal(int) would), but still goes through _reformat:
+# the result's display has to keep the separators the value was written with.
+
+# Results of int/int arithmetic below this bound are exact in the default 28-digit
+# Decimal context, so computing them with Python ints gives the very same value
+DECIMAL_EXACT_INT_LIMIT = 10 ** 28
+DIVIDED_BY_EXACT_INT_LIMIT = 10 ** DIVIDED_BY_PRECISION
+
+@lru_cache(maxsize=64)
+def division_context(precision):
+    return Context(prec=precision)
+
 def make_math_filters(LF):
 
     def _to_decimal(val):
@@ -111,6 +138,8 @@ def make_math_filters(LF):
         """
         if isinstance(val, LF):
             return val._decimal
+        if type(val) is int:
+            return Decimal(val)
         if isinstance(val, bool):
             # bool is a subclass of int in Python; True=1, False=0
             return Decimal(int(val))
@@ -141,27 +170,50 @@ def make_math_filters(LF):
     # ───────────────────────────────────────────────────────────────
 
     def plus(val, other=0):
+        if type(val) is int and type(other) is int:
+            result = val + other
+            if -DECIMAL_EXACT_INT_LIMIT < result < DECIMAL_EXACT_INT_LIMIT:
+                return result
+        if isinstance(val, LF) and type(other) is int:
+            return val._reformat(val._decimal + other)
         return _output(val, _to_decimal(val) + _to_decimal(other))
 
     def minus(val, other=0):
+        if type(val) is int and type(other) is int:
+            result = val - other
+            if -DECIMAL_EXACT_INT_LIMIT < result < DECIMAL_EXACT_INT_LIMIT:
+                return result
+        if isinstance(val, LF) and type(other) is int:
+            return val._reformat(val._decimal - other)
         return _output(val, _to_decimal(val) - _to_decimal(other))
 
     def times(val, other=1):
+        if type(val) is int and type(other) is int:
+            result = val * other
+            if -DECIMAL_EXACT_INT_LIMIT < result < DECIMAL_EXACT_INT_LIMIT:
+                return result
+        if isinstance(val, LF) and type(other) is int:
+            return val._reformat(val._decimal * other)
         return _output(val, _to_decimal(val) * _to_decimal(other))
 
     def divided_by(val, other=1):
-        d_val, d_other = _to_decimal(val), _to_decimal(other)
+        if type(val) is int and type(other) is int and other != 0 and val % other == 0:
+            # Exact quotient that fits in the precision: no rounding would happen
+            result = val // other
+            if -DIVIDED_BY_EXACT_INT_LIMIT < result < DIVIDED_BY_EXACT_INT_LIMIT:
+                return result
+
         if isinstance(val, LF):
-            with localcontext() as ctx:
-                ctx.prec = len(str(abs(int(val)))) + DIVIDED_BY_PRECISION
-                result = d_val / d_other
-        else:
-            with localcontext() as ctx:
-                ctx.prec = DIVIDED_BY_PRECISION
-                result = d_val / d_other
-        return _output(val, result)
+            context = division_context(len(str(abs(int(val)))) + DIVIDED_BY_PRECISION)
+            d_other = other if type(other) is int else _to_decimal(other)
+            return val._reformat(context.divide(val._decimal, d_other))
+        return _output(val, division_context(DIVIDED_BY_PRECISION).divide(_to_decimal(val), _to_decimal(other)))
 
     def modulo(val, other=1):
+        # Decimal keeps the sign of the dividend and Python the sign of the divisor,
+        # they only agree for non-negative operands (and Decimal fails on huge quotients)
+        if type(val) is int and type(other) is int and 0 <= val < DECIMAL_EXACT_INT_LIMIT and other > 0:
+            return val % other
         return _output(val, _to_decimal(val) % _to_decimal(other))
 
     def round_(val, ndigits=None):
@@ -1,26 +1,39 @@
-from threading import Event, Lock, current_thread
+from threading import Event, Lock, Thread, current_thread
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 import functions_framework
 from dotenv import load_dotenv
 import os
-from google.oauth2.credentials import Credentials
-import requests
 from io import BytesIO, StringIO
 from docx import Document
 from docx.text.paragraph import Paragraph
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import parse_xml as parse_docx_xml
+from docx.oxml.ns import qn
 from pptx import Presentation
+from pptx.oxml import parse_xml as parse_pptx_xml
+from pptx.text.text import _Paragraph
 from google.cloud import storage
 from google.cloud.storage.blob import Blob
+from google.api_core.exceptions import NotFound
 import re
-import google.auth.transport.requests
-import google.oauth2.id_token
+import hashlib
+import json
+import time
+import uuid
+import zipfile
+from lxml import etree
+from backend_client import BackendClient
+from requests import HTTPError
 from liquid import RenderContext
 from liquid_types import LiquidDate, LiquidFloat, liquid_environment
+from pdf_converters import GoogleDriveClient, LibreOfficeConverter, PdfConverter, PdfConverterFunction
 from pydantic import BaseModel, ValidationError
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 from enum import Enum
 from datetime import datetime
 import re
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
 
 load_dotenv()
@@ -34,15 +47,44 @@ GOOGLE_REFRESH_TOKEN = os.getenv('GOOGLE_REFRESH_TOKEN')
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
 MAX_ATTEMPTS = int(os.getenv('MAX_ATTEMPTS', '50'))
-
-for var_name, var_value in {
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '4')) # Rows rendered concurrently in a batch request
+REQUEST_CONCURRENCY = int(os.getenv('REQUEST_CONCURRENCY', '6')) # Requests an instance serves at once (max_instance_request_concurrency)
+UPLOAD_SOURCE_FILE = os.getenv('UPLOAD_SOURCE_FILE', 'true').lower() == 'true' # Keep the rendered DOCX/PPTX next to the PDF
+PDF_CONVERTER = os.getenv('PDF_CONVERTER', 'google_drive') # 'google_drive' | 'libreoffice'
+SOFFICE_PATH = os.getenv('SOFFICE_PATH', 'soffice')
+UNO_PYTHON = os.getenv('UNO_PYTHON', '/usr/bin/python3') # Python able to `import uno` (python3-uno)
+LIBREOFFICE_POOL_SIZE = int(os.getenv('LIBREOFFICE_POOL_SIZE', '2')) # Warm soffice processes per instance
+LIBREOFFICE_TIMEOUT_SECONDS = int(os.getenv('LIBREOFFICE_TIMEOUT_SECONDS', '120'))
+TEMPLATE_CACHE_MAX_BYTES = int(os.getenv('TEMPLATE_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+TEMPLATE_CACHE_TTL_SECONDS = int(os.getenv('TEMPLATE_CACHE_TTL_SECONDS', '0')) # 0 disables expiration
+CERTIFICATE_DEDUPLICATION = os.getenv('CERTIFICATE_DEDUPLICATION', 'true').lower() == 'true' # Copy certificates with the same content instead of rendering again
+CERTIFICATE_INDEX_MAX_ENTRIES = int(os.getenv('CERTIFICATE_INDEX_MAX_ENTRIES', '10000'))
+EXPORT_READ_CHUNK_BYTES = int(os.getenv('EXPORT_READ_CHUNK_BYTES', str(1024 * 1024)))
+EXPORT_UPLOAD_CHUNK_BYTES = int(os.getenv('EXPORT_UPLOAD_CHUNK_BYTES', str(8 * 1024 * 1024))) # Multiple of 256 KiB
+LIQUID_SINGLE_STREAM = os.getenv('LIQUID_SINGLE_STREAM', 'true').lower() == 'true' # Render all blocks as one template per row
+TEMPLATE_REVALIDATE_SECONDS = int(os.getenv('TEMPLATE_REVALIDATE_SECONDS', '0')) # How long a checked template is trusted, 0 rechecks on every request
+
+GENERATION_REPORT_BATCH_SIZE = int(os.getenv('GENERATION_REPORT_BATCH_SIZE', '50'))
+GENERATION_REPORT_FLUSH_SECONDS = float(os.getenv('GENERATION_REPORT_FLUSH_SECONDS', '2'))
+BACKEND_POOL_MAXSIZE = int(os.getenv('BACKEND_POOL_MAXSIZE', '10')) # Keep-alive connections kept to APP_BASE_URL
+GOOGLE_DRIVE_STATIC_DISCOVERY = os.getenv('GOOGLE_DRIVE_STATIC_DISCOVERY', 'true').lower() == 'true' # Bundled discovery document, no fetch
+
+if PDF_CONVERTER not in ('google_drive', 'libreoffice'):
+    raise ValueError(f"Environment variable 'PDF_CONVERTER' has an invalid value: {PDF_CONVERTER}")
+
+required_env_vars = {
     "APP_BASE_URL": APP_BASE_URL,
     "CERTIFICATES_BUCKET": CERTIFICATES_BUCKET,
-    "GOOGLE_DRIVE_FOLDER_ID": GOOGLE_DRIVE_FOLDER_ID,
-    "GOOGLE_REFRESH_TOKEN": GOOGLE_REFRESH_TOKEN,
-    "GOOGLE_CLIENT_ID": GOOGLE_CLIENT_ID,
-    "GOOGLE_CLIENT_SECRET": GOOGLE_CLIENT_SECRET
-}.items():
+}
+if PDF_CONVERTER == 'google_drive':
+    required_env_vars.update({
+        "GOOGLE_DRIVE_FOLDER_ID": GOOGLE_DRIVE_FOLDER_ID,
+        "GOOGLE_REFRESH_TOKEN": GOOGLE_REFRESH_TOKEN,
+        "GOOGLE_CLIENT_ID": GOOGLE_CLIENT_ID,
+        "GOOGLE_CLIENT_SECRET": GOOGLE_CLIENT_SECRET
+    })
+
+for var_name, var_value in required_env_vars.items():
     if not var_value:
         raise ValueError(f"Environment variable '{var_name}' is not set.")
 
@@ -82,28 +124,46 @@ def paragraph_universal_iterator(doc):
             yield Paragraph(xml_p, doc)
 
 def consolidate_broken_runs(paragraph):
-    """Merges runs within the SAME paragraph to fix Word breaks."""
-    text = paragraph.text
-    if not ('{{' in text or '{%' in text):
-        return
+    """
+    Merges runs within the SAME paragraph to fix Word/PowerPoint breaks, so that a tag
+    opened in a run ('{{' or '{%') is closed in that same run. Works for DOCX and PPTX
+    paragraphs.
 
+    The run texts are read once and each affected run is written once: the opening run
+    gets the merged text, the runs merged into it are cleared.
+    """
     runs = paragraph.runs
-    if not runs: return
+    if not runs:
+        return
+
+    texts = [run.text for run in runs]
+    if not any('{{' in text or '{%' in text for text in texts):
+        return
 
     i = 0
     while i < len(runs):
-        text_run = runs[i].text
-        has_open = '{%' in text_run or '{{' in text_run
-        
-        if has_open:
-            closure = '%}' if '{%' in text_run else '}}'
-            j = i + 1
-            while closure not in runs[i].text and j < len(runs):
-                next_run = runs[j]
-                runs[i].text += next_run.text
+        text_run = texts[i]
+        if not ('{%' in text_run or '{{' in text_run):
+            i += 1
+            continue
+
+        closure = '%}' if '{%' in text_run else '}}'
+        closed = closure in text_run
+        tail = text_run[-1:]
+        j = i + 1
+        while not closed and j < len(runs):
+            next_text = texts[j]
+            # A closure the merge creates either lies in the next text or straddles the join
+            closed = closure in tail + next_text
+            if next_text:
+                tail = next_text[-1]
+            j += 1
+
+        if j > i + 1:
+            runs[i].text = "".join(texts[i:j])
+            for next_run in runs[i + 1:j]:
                 next_run.text = ""
-                j += 1
-        i += 1
+        i = j
 
 def calculate_delta_blocks(text):
     """
@@ -122,111 +182,6 @@ def calculate_delta_blocks(text):
             delta -= 1
     return delta
 
-def process_buffer(paragraph_list, text_list, liquid_ctx):
-    '''
-    Takes N paragraphs, joins the text, runs Liquid, and returns the result
-    in the FIRST paragraph, deleting the others.
-    '''
-    # Joins with line breaks to simulate the original document
-    complete_text = "\n".join(text_list)
-
-    # If there is no liquid syntax, ignore
-    if not ("{{" in complete_text or "{%" in complete_text):
-        return
-
-    sanitized_text = (complete_text
-                      .replace('“', '"').replace('”', '"')
-                      .replace('‘', "'").replace('’', "'"))
-    if "append" in sanitized_text:
-        print(f"DEBUG LIQUID: {sanitized_text}")
-
-    try:
-        template = liquid_environment.from_string(sanitized_text)
-        buf = StringIO()
-        template.render_with_context(liquid_ctx, buf)
-        new_complete_text = buf.getvalue()
-        # If the text did not change, do nothing (preserves original formatting)
-        if new_complete_text == complete_text:
-            return
-
-        # MULTI-LINE REPLACEMENT STRATEGY:
-        # 1. Put EVERYTHING in the first paragraph of the buffer
-        main_paragraph = paragraph_list[0]
-        
-        # Clear runs of the main paragraph
-        for run in main_paragraph.runs:
-            run.text = ""
-        # Add the new text (may contain line breaks resulting from liquid)
-        # Note: python-docx handles '\n' inside a run by creating soft breaks, 
-        # but visually it works for the purpose.
-        if main_paragraph.runs:
-            main_paragraph.runs[0].text = new_complete_text
-        else:
-            main_paragraph.add_run(new_complete_text)
-
-        # 2. Clear the subsequent paragraphs that were part of the block
-        # Ex: The paragraph that had the "{% else %}" and the "{% endif %}"
-        for p_lixo in paragraph_list[1:]:
-            for run in p_lixo.runs:
-                run.text = ""
-            # Optional: If you want to remove the paragraph entirely (may break layout if it's a table)
-            # p_lixo._element.getparent().remove(p_lixo._element) 
-            # Recommended to just clear the text to keep the table/doc structure safe.
-
-    except Exception as e:
-        print(f"Error Liquid block started in '{text_list[0][:20]}...': {e}")
-
-def replace_variables_in_docx_liquid(in_buffer, context_data):
-    in_buffer.seek(0)
-    doc = Document(in_buffer)
-
-    # 1. Pre-processing: Consolidate runs (intra-line)
-    # This ensures that '{% if' is not split across different runs in the same line
-    all_paragraphs = list(paragraph_universal_iterator(doc))
-    for p in all_paragraphs:
-        consolidate_broken_runs(p)
-
-    # Shared context so {% assign %} variables persist across paragraph renders
-    liquid_ctx = RenderContext(liquid_environment.from_string(""), globals=context_data)
-
-    # 2. Processing with Buffer (Inter-line)
-    buffer_paragraphs = []
-    accumulated_text = []
-    block_level = 0
-
-    idx = 0
-    while idx < len(all_paragraphs):
-        p = all_paragraphs[idx]
-        paragraph_text = p.text
-
-        delta = calculate_delta_blocks(paragraph_text)
-
-        if block_level > 0 or (delta > 0):
-            buffer_paragraphs.append(p)
-            accumulated_text.append(paragraph_text)
-            block_level += delta
-
-            if block_level == 0:
-                process_buffer(buffer_paragraphs, accumulated_text, liquid_ctx)
-                buffer_paragraphs = []
-                accumulated_text = []
-
-        else:
-            process_buffer([p], [paragraph_text], liquid_ctx)
-
-        idx += 1
-
-    if buffer_paragraphs:
-        print("WARNING: Liquid block not closed at the end of the document.")
-        process_buffer(buffer_paragraphs, accumulated_text, liquid_ctx)
-
-    # 3. Save
-    out_buffer = BytesIO()
-    doc.save(out_buffer)
-    out_buffer.seek(0)
-    return out_buffer
-
-
 #################################### Functions to process PPTX with Liquid ####################################
 def pptx_paragraph_iterator(prs):
     """
@@ -253,127 +208,462 @@ def pptx_paragraph_iterator(prs):
             yield from process_shape(shape)
 
 
-def consolidate_broken_runs_pptx(paragraph):
-    """Merges runs within the SAME paragraph to fix PowerPoint breaks."""
-    text = "".join(run.text for run in paragraph.runs)
-    if not ('{{' in text or '{%' in text):
-        return
-
-    runs = paragraph.runs
-    if not runs:
-        return
-
-    i = 0
-    while i < len(runs):
-        text_run = runs[i].text
-        has_open = '{%' in text_run or '{{' in text_run
-        
-        if has_open:
-            closure = '%}' if '{%' in text_run else '}}'
-            j = i + 1
-            while closure not in runs[i].text and j < len(runs):
-                next_run = runs[j]
-                runs[i].text += next_run.text
-                next_run.text = ""
-                j += 1
-        i += 1
+#################################### Template plan ####################################
+EMPTY_TEMPLATE = liquid_environment.from_string("")
+TIME_DEPENDENT_REGEX = re.compile(r"""["'](now|today)["']""")
 
+class PlanBlock:
+    """
+    A group of paragraphs rendered as a single Liquid template: one paragraph, or the
+    consecutive paragraphs spanned by a block tag ({% if %} ... {% endif %}).
+    """
+    def __init__(self, locations, complete_text, source, template, label):
+        self.locations = locations # [(partname, path)], path = child indexes from the part's root element
+        self.complete_text = complete_text
+        self.source = source # Liquid source, after quote sanitization
+        self.template = template
+        self.label = label
+
+class TemplatePlan:
+    """
+    Everything about a template that does not depend on row data, compiled once per
+    template generation:
+    - `parts`: the XML parts that contain Liquid markup, with broken runs already consolidated
+    - `static_zip`: a zip with every other member of the package, never touched per row
+    - `blocks`: the pre-parsed Liquid blocks, in rendering order
+    - `stream_template`: every block joined into one template, split apart by anchors
+      (None when the joined template does not parse or LIQUID_SINGLE_STREAM is off)
+    - `part_segments`: for the parts where it could be built, the index of the paragraphs
+      the blocks touch, so a row only parses and serializes those paragraphs
+    """
+    def __init__(self, is_docx, template_bytes, static_zip, parts, blocks, stream_template=None, part_segments=None):
+        self.is_docx = is_docx
+        self.template_bytes = template_bytes
+        self.template_hash = hashlib.sha256(template_bytes).hexdigest()
+        # 'now'/'today' make the output depend on when it is rendered, not only on the row
+        self.is_deterministic = not any(TIME_DEPENDENT_REGEX.search(block.source) for block in blocks)
+        self.static_zip = static_zip
+        self.parts = parts # {partname: (ZipInfo, xml bytes)}
+        self.blocks = blocks
+        self.stream_template = stream_template
+        self.part_segments = part_segments or {} # {partname: PartSegments}
+
+    @property
+    def size_bytes(self):
+        """Approximate memory held by the plan, used as its weight in the template cache."""
+        return (
+            len(self.template_bytes)
+            + len(self.static_zip)
+            + sum(len(xml_bytes) for _, xml_bytes in self.parts.values())
+            + 2 * sum(len(block.complete_text) for block in self.blocks) # Block sources and the stream
+            + sum(len(self.parts[partname][1]) for partname in self.part_segments) # Segments
+        )
 
-def process_buffer_pptx(paragraph_list, text_list, liquid_ctx):
+class PartSegments:
     """
-    Takes N paragraphs, joins the text, runs Liquid, and returns the result
-    in the FIRST paragraph, clearing the others.
+    A Liquid part cut around the paragraphs its blocks touch: `segments` alternates static
+    XML and paragraph XML, and joining it gives back the part as serialized from its
+    tree. `slots` maps the path of each paragraph to its segment index and to the wrapper
+    (an element declaring the namespaces in scope at that paragraph) needed to parse it
+    on its own.
     """
+    def __init__(self, segments, slots):
+        self.segments = segments
+        self.slots = slots # {tuple(path): (segment index, (wrapper_open, wrapper_close))}
+
+def element_path(element):
+    """Child indexes leading from the root of the element's tree down to it."""
+    path = []
+    parent = element.getparent()
+    while parent is not None:
+        path.append(parent.index(element))
+        element, parent = parent, parent.getparent()
+    path.reverse()
+    return path
+
+def resolve_element_path(root, path):
+    element = root
+    for index in path:
+        element = element[index]
+    return element
+
+def compile_plan_block(locations, text_list):
+    # Joins with line breaks to simulate the original document
     complete_text = "\n".join(text_list)
 
+    # If there is no liquid syntax, ignore
     if not ("{{" in complete_text or "{%" in complete_text):
-        return
+        return None
 
     sanitized_text = (complete_text
                       .replace('“', '"').replace('”', '"')
                       .replace('‘', "'").replace('’', "'"))
-
     if "append" in sanitized_text:
-        print(f"DEBUG LIQUID PPTX: {sanitized_text}")
+        print(f"DEBUG LIQUID: {sanitized_text}")
 
     try:
         template = liquid_environment.from_string(sanitized_text)
-        buf = StringIO()
-        template.render_with_context(liquid_ctx, buf)
-        new_complete_text = buf.getvalue()
-        
-        if new_complete_text == complete_text:
-            return
-
-        main_paragraph = paragraph_list[0]
-        
-        for run in main_paragraph.runs:
-            run.text = ""
-        
-        if main_paragraph.runs:
-            main_paragraph.runs[0].text = new_complete_text
-        else:
-            main_paragraph.add_run().text = new_complete_text
-
-        for p in paragraph_list[1:]:
-            for run in p.runs:
-                run.text = ""
-
     except Exception as e:
         print(f"Error Liquid block started in '{text_list[0][:20]}...': {e}")
+        return None
 
+    return PlanBlock(locations, complete_text, sanitized_text, template, text_list[0][:20])
 
-def replace_variables_in_pptx_liquid(in_buffer, context_data):
-    in_buffer.seek(0)
-    prs = Presentation(in_buffer)
+# NUL cannot appear in OOXML text, so an anchor never collides with document content
+def stream_anchor(index):
+    return f"\x00{index}\x00"
 
-    # 1. Pre-processing: Consolidate runs (intra-line)
-    all_paragraphs = list(pptx_paragraph_iterator(prs))
-    for p, _ in all_paragraphs:
-        consolidate_broken_runs_pptx(p)
+STREAM_ANCHOR_REGEX = re.compile(r'\x00(\d+)\x00')
 
-    # Shared context so {% assign %} variables persist across paragraph renders
-    liquid_ctx = RenderContext(liquid_environment.from_string(""), globals=context_data)
+def compile_stream_template(blocks):
+    """
+    Joins the blocks into a single Liquid template, each one preceded by its anchor, so
+    a row is rendered with one call instead of one per block.
+    """
+    if not blocks:
+        return None
 
-    # 2. Processing with Buffer (Inter-line)
-    buffer_paragraphs = []
+    stream_source = "".join(stream_anchor(index) + block.source for index, block in enumerate(blocks))
+    try:
+        return liquid_environment.from_string(stream_source)
+    except Exception as e:
+        print(f"Template will be rendered block by block, the joined stream does not parse: {e}")
+        return None
+
+def split_stream_output(output, block_count):
+    """Splits a rendered stream back into the output of each block, or None if the anchors are off."""
+    pieces = STREAM_ANCHOR_REGEX.split(output)
+    # ['', '0', <output of block 0>, '1', <output of block 1>, ...]
+    if len(pieces) != 2 * block_count + 1 or pieces[0]:
+        return None
+    if any(pieces[2 * index + 1] != str(index) for index in range(block_count)):
+        return None
+    return pieces[2::2]
+
+def docx_header_footer_stories(doc):
+    """Yields the paragraphs of each header/footer part of the document, one list per part."""
+    parts = {
+        str(rel.target_part.partname): rel.target_part
+        for rel in doc.part.rels.values()
+        if not rel.is_external and rel.reltype in (RT.HEADER, RT.FOOTER)
+    }
+    for partname in sorted(parts):
+        part = parts[partname]
+        yield [(Paragraph(xml_p, None), part) for xml_p in part.element.iter(qn('w:p'))]
+
+def group_story_blocks(located_paragraphs, paragraph_text, story_name):
+    """
+    Groups consecutive paragraphs of a story into blocks, so that block tags spanning
+    several paragraphs ({% if %} ... {% endif %}) are rendered together.
+    Returns a list of (locations, texts).
+    """
+    groups = []
+    buffer_locations = []
     accumulated_text = []
     block_level = 0
 
-    idx = 0
-    while idx < len(all_paragraphs):
-        p, _ = all_paragraphs[idx]
-        paragraph_text = "".join(run.text for run in p.runs)
+    for p, part in located_paragraphs:
+        text = paragraph_text(p)
+        location = (str(part.partname), element_path(p._p))
 
-        delta = calculate_delta_blocks(paragraph_text)
+        delta = calculate_delta_blocks(text)
 
         if block_level > 0 or (delta > 0):
-            buffer_paragraphs.append(p)
-            accumulated_text.append(paragraph_text)
+            buffer_locations.append(location)
+            accumulated_text.append(text)
             block_level += delta
 
             if block_level == 0:
-                process_buffer_pptx(buffer_paragraphs, accumulated_text, liquid_ctx)
-                buffer_paragraphs = []
+                groups.append((buffer_locations, accumulated_text))
+                buffer_locations = []
                 accumulated_text = []
 
         else:
-            process_buffer_pptx([p], [paragraph_text], liquid_ctx)
+            groups.append(([location], [text]))
+
+    if buffer_locations:
+        print(f"WARNING: Liquid block not closed at the end of the {story_name}.")
+        groups.append((buffer_locations, accumulated_text))
+
+    return groups
+
+def compile_template_plan(template_bytes: bytes, is_docx: bool) -> TemplatePlan:
+    if is_docx:
+        package = Document(BytesIO(template_bytes))
+        stories = [
+            ('document', [(p, package.part) for p in paragraph_universal_iterator(package)]),
+            *(('header/footer', story) for story in docx_header_footer_stories(package)),
+        ]
+        paragraph_text = lambda p: p.text
+    else:
+        package = Presentation(BytesIO(template_bytes))
+        stories = [
+            ('presentation', [(p, shape.part) for p, shape in pptx_paragraph_iterator(package)]),
+        ]
+        paragraph_text = lambda p: "".join(run.text for run in p.runs)
+
+    # 1. Pre-processing: Consolidate runs (intra-line)
+    # This ensures that '{% if' is not split across different runs in the same line
+    for _, located_paragraphs in stories:
+        for p, _ in located_paragraphs:
+            consolidate_broken_runs(p)
+
+    # 2. Grouping with Buffer (Inter-line)
+    groups = []
+    for story_name, located_paragraphs in stories:
+        groups.extend(group_story_blocks(located_paragraphs, paragraph_text, story_name))
+
+    blocks = [block for block in (compile_plan_block(*group) for group in groups) if block]
+
+    # 3. Split the package: parts with Liquid blocks are kept as XML and rewritten per row,
+    # every other member goes once into a zip that rows copy as is
+    liquid_partnames = {partname for block in blocks for partname, _ in block.locations}
+
+    consolidated_buffer = BytesIO()
+    package.save(consolidated_buffer)
+
+    # save() stamps every member with the current time. Keep the template's own timestamps
+    # instead, so the same row renders the same bytes whenever the plan is compiled
+    with zipfile.ZipFile(BytesIO(template_bytes)) as template_zip:
+        template_dates = {info.filename: info.date_time for info in template_zip.infolist()}
+
+    parts = {}
+    static_buffer = BytesIO()
+    with zipfile.ZipFile(consolidated_buffer) as package_zip, zipfile.ZipFile(static_buffer, 'w') as static_zip:
+        for info in package_zip.infolist():
+            info.date_time = template_dates.get(info.filename, (1980, 1, 1, 0, 0, 0))
+            partname = f'/{info.filename}'
+            if partname in liquid_partnames:
+                parts[partname] = (info, package_zip.read(info))
+            else:
+                static_zip.writestr(info, package_zip.read(info))
+
+    stream_template = compile_stream_template(blocks) if LIQUID_SINGLE_STREAM else None
+
+    # 4. Index the paragraphs the blocks touch, so rows skip everything else in the part
+    parse_part_xml = parse_docx_xml if is_docx else parse_pptx_xml
+    part_paths = {}
+    for block in blocks:
+        for partname, path in block.locations:
+            part_paths.setdefault(partname, []).append(path)
+
+    part_segments = {}
+    for partname, paths in part_paths.items():
+        segments = index_part_paragraphs(parts[partname][1], paths, parse_part_xml)
+        if segments is not None:
+            part_segments[partname] = segments
+        else:
+            print(f"Part {partname} will be rendered as a whole tree")
+
+    return TemplatePlan(is_docx, template_bytes, static_buffer.getvalue(), parts, blocks, stream_template, part_segments)
+
+def paragraph_wrapper(paragraph_element):
+    """Opening/closing tags of an element that puts the paragraph's in-scope namespaces back."""
+    parent = paragraph_element.getparent()
+    wrapper = etree.Element(parent.tag, nsmap=parent.nsmap)
+    wrapper.text = "x"
+    wrapper_xml = etree.tostring(wrapper, encoding='UTF-8', xml_declaration=False)
+    split_at = wrapper_xml.index(b'>x<')
+    return wrapper_xml[:split_at + 1], wrapper_xml[split_at + 2:]
 
-        idx += 1
+def parse_wrapped_paragraph(parse_part_xml, paragraph_xml, wrapper):
+    wrapper_open, wrapper_close = wrapper
+    return parse_part_xml(wrapper_open + paragraph_xml + wrapper_close)[0]
 
-    if buffer_paragraphs:
-        print("WARNING: Liquid block not closed at the end of the presentation.")
-        process_buffer_pptx(buffer_paragraphs, accumulated_text, liquid_ctx)
+def serialize_wrapped_paragraph(paragraph_element, wrapper):
+    wrapper_open, wrapper_close = wrapper
+    wrapper_xml = etree.tostring(paragraph_element.getparent(), encoding='UTF-8', xml_declaration=False)
+    return wrapper_xml[len(wrapper_open):len(wrapper_xml) - len(wrapper_close)]
+
+def index_part_paragraphs(xml_bytes, paths, parse_part_xml) -> Optional[PartSegments]:
+    """
+    Cuts a part, as serialized from its tree, into static XML and the XML of the given
+    paragraphs, by serializing it with comment markers around them. Returns None when the part cannot be spliced
+    safely (nested paragraphs, or cut XML that does not round-trip to the same bytes):
+    rows then rewrite the whole part tree, as before.
+    """
+    root = parse_part_xml(xml_bytes)
+    # What rewriting the whole tree would produce, which is not always the stored bytes
+    # (the pptx parser drops blank text, for instance)
+    tree_xml = serialize_part_xml(root)
+    paths = sorted({tuple(path) for path in paths}) # Document order
+    elements = [resolve_element_path(root, path) for path in paths]
+
+    # A textbox paragraph inside another marked paragraph cannot be spliced on its own
+    marked = set(elements)
+    if any(ancestor in marked for element in elements for ancestor in element.iterancestors()):
+        return None
+
+    wrappers = [paragraph_wrapper(element) for element in elements]
+    for index, element in enumerate(elements):
+        element.addprevious(etree.Comment(f"liquid-paragraph-start-{index}"))
+        element.addnext(etree.Comment(f"liquid-paragraph-end-{index}"))
+    marked_xml = serialize_part_xml(root)
+
+    segments = []
+    slots = {}
+    position = 0
+    for index, path in enumerate(paths):
+        start_marker = f"<!--liquid-paragraph-start-{index}-->".encode()
+        end_marker = f"<!--liquid-paragraph-end-{index}-->".encode()
+        start = marked_xml.find(start_marker, position)
+        end = marked_xml.find(end_marker, start)
+        if start < 0 or end < 0:
+            return None
+
+        segments.append(marked_xml[position:start])
+        paragraph_xml = marked_xml[start + len(start_marker):end]
+        slots[path] = (len(segments), wrappers[index])
+        segments.append(paragraph_xml)
+        position = end + len(end_marker)
+
+        try:
+            element = parse_wrapped_paragraph(parse_part_xml, paragraph_xml, wrappers[index])
+            if serialize_wrapped_paragraph(element, wrappers[index]) != paragraph_xml:
+                return None
+        except Exception:
+            return None
+    segments.append(marked_xml[position:])
+
+    if b"".join(segments) != tree_xml:
+        return None
+    return PartSegments(segments, slots)
+
+def write_block_result(paragraph_list, new_complete_text):
+    """
+    Puts the rendered text in the FIRST paragraph of the block and clears the others.
+    """
+    main_paragraph = paragraph_list[0]
+
+    # Clear runs of the main paragraph
+    for run in main_paragraph.runs:
+        run.text = ""
+    # Add the new text (may contain line breaks resulting from liquid)
+    # Note: python-docx handles '\n' inside a run by creating soft breaks,
+    # but visually it works for the purpose.
+    if main_paragraph.runs:
+        main_paragraph.runs[0].text = new_complete_text
+    else:
+        main_paragraph.add_run().text = new_complete_text
+
+    # Clear the subsequent paragraphs that were part of the block
+    # Ex: The paragraph that had the "{% else %}" and the "{% endif %}"
+    # Just clearing the text keeps the table/doc structure safe.
+    for p in paragraph_list[1:]:
+        for run in p.runs:
+            run.text = ""
+
+def render_plan_stream(plan: TemplatePlan, context_data):
+    """
+    Renders every block with a single call on the plan's stream template. Returns the
+    output of each block, or None so the caller falls back to rendering block by block
+    (a render error or a broken anchor sequence).
+    """
+    try:
+        buf = StringIO()
+        plan.stream_template.render_with_context(RenderContext(EMPTY_TEMPLATE, globals=context_data), buf)
+    except Exception as e:
+        print(f"Error rendering the Liquid stream, falling back to block by block: {e}")
+        return None
+
+    rendered_texts = split_stream_output(buf.getvalue(), len(plan.blocks))
+    if rendered_texts is None:
+        print("Liquid stream anchors do not match the blocks, falling back to block by block")
+    return rendered_texts
+
+def render_plan_blocks(plan: TemplatePlan, context_data):
+    """Renders each block on its own. A failing block yields None and keeps its original text."""
+    # Shared context so {% assign %} variables persist across block renders
+    liquid_ctx = RenderContext(EMPTY_TEMPLATE, globals=context_data)
+
+    rendered_texts = []
+    for block in plan.blocks:
+        try:
+            buf = StringIO()
+            block.template.render_with_context(liquid_ctx, buf)
+            rendered_texts.append(buf.getvalue())
+        except Exception as e:
+            print(f"Error Liquid block started in '{block.label}...': {e}")
+            rendered_texts.append(None)
+    return rendered_texts
+
+def render_template_plan(plan: TemplatePlan, context_data) -> BytesIO:
+    """
+    Renders a row by patching only the XML parts with Liquid markup, and within them
+    only the paragraphs whose block output changed: indexed parts parse and serialize
+    just those paragraphs, the others parse the whole part on first write. The results
+    are appended to a copy of the plan's static zip, so images, fonts and media are
+    neither loaded nor recompressed.
+    """
+    if plan.is_docx:
+        parse_part_xml = parse_docx_xml
+        make_paragraph = lambda element: Paragraph(element, None)
+    else:
+        parse_part_xml = parse_pptx_xml
+        make_paragraph = lambda element: _Paragraph(element, None)
+
+    part_elements = {} # Whole trees of the parts without an index
+    paragraph_elements = {} # {partname: {path: element}} of the indexed parts
+    def get_paragraph_element(partname, path):
+        part_segments = plan.part_segments.get(partname)
+        if part_segments is None:
+            if partname not in part_elements:
+                part_elements[partname] = parse_part_xml(plan.parts[partname][1])
+            return resolve_element_path(part_elements[partname], path)
+
+        elements = paragraph_elements.setdefault(partname, {})
+        key = tuple(path)
+        if key not in elements:
+            segment_index, wrapper = part_segments.slots[key]
+            elements[key] = parse_wrapped_paragraph(parse_part_xml, part_segments.segments[segment_index], wrapper)
+        return elements[key]
+
+    rendered_texts = render_plan_stream(plan, context_data) if plan.stream_template else None
+    if rendered_texts is None:
+        rendered_texts = render_plan_blocks(plan, context_data)
+
+    for block, new_complete_text in zip(plan.blocks, rendered_texts):
+        # If the block failed or the text did not change, do nothing (preserves original formatting)
+        if new_complete_text is None or new_complete_text == block.complete_text:
+            continue
+
+        try:
+            paragraph_list = [
+                make_paragraph(get_paragraph_element(partname, path))
+                for partname, path in block.locations
+            ]
+            write_block_result(paragraph_list, new_complete_text)
+        except Exception as e:
+            print(f"Error Liquid block started in '{block.label}...': {e}")
+
+    out_buffer = BytesIO(plan.static_zip)
+    with zipfile.ZipFile(out_buffer, 'a') as package_zip:
+        for partname, (info, xml_bytes) in plan.parts.items():
+            if partname in part_elements:
+                xml_bytes = serialize_part_xml(part_elements[partname])
+            elif partname in paragraph_elements:
+                part_segments = plan.part_segments[partname]
+                segments = list(part_segments.segments)
+                for key, element in paragraph_elements[partname].items():
+                    segment_index, wrapper = part_segments.slots[key]
+                    segments[segment_index] = serialize_wrapped_paragraph(element, wrapper)
+                xml_bytes = b"".join(segments)
+            package_zip.writestr(info, xml_bytes)
 
-    # 3. Save
-    out_buffer = BytesIO()
-    prs.save(out_buffer)
     out_buffer.seek(0)
     return out_buffer
 
 
 #################################### Function to convert certificate to pdf ####################################
+if PDF_CONVERTER == 'google_drive':
+    drive_client = GoogleDriveClient(
+        GOOGLE_CLIENT_ID,
+        GOOGLE_CLIENT_SECRET,
+        GOOGLE_REFRESH_TOKEN,
+        scopes=["https://www.googleapis.com/auth/drive.file", "https://www.googleapis.com/auth/drive.readonly"],
+        static_discovery=GOOGLE_DRIVE_STATIC_DISCOVERY,
+    )
+
 def convert_to_pdf_with_google_drive(input_bytes: BytesIO, input_ext: str) -> BytesIO:
     """
     Convert DOCX or PPTX to PDF using Google Drive API:
@@ -395,15 +685,7 @@ def convert_to_pdf_with_google_drive(input_bytes: BytesIO, input_ext: str) -> By
     if not mime_type:
         raise ValueError(f"Unsupported file extension: {input_ext}")
     
-    credentials = Credentials(
-        None,
-        refresh_token=GOOGLE_REFRESH_TOKEN,
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=GOOGLE_CLIENT_ID,
-        client_secret=GOOGLE_CLIENT_SECRET,
-        scopes=["https://www.googleapis.com/auth/drive.file", 'https://www.googleapis.com/auth/drive.readonly',],
-    )
-    drive_service = build('drive', 'v3', credentials=credentials)
+    drive_service = drive_client.service()
     
     try:
         file_metadata = {
@@ -441,94 +723,219 @@ def convert_to_pdf_with_google_drive(input_bytes: BytesIO, input_ext: str) -> By
         print(f"Error converting with Google Drive: {e}")
         raise
 
+if PDF_CONVERTER == 'libreoffice':
+    pdf_converter: PdfConverter = LibreOfficeConverter(
+        SOFFICE_PATH,
+        pool_size=LIBREOFFICE_POOL_SIZE,
+        uno_python=UNO_PYTHON,
+        timeout=LIBREOFFICE_TIMEOUT_SECONDS,
+    )
+else:
+    pdf_converter: PdfConverter = PdfConverterFunction(convert_to_pdf_with_google_drive)
+
 
 #################################### Functions to use bucket ####################################
-def upload_to_bucket(file_buffer, file_path, content_type="application/pdf"):
+def upload_to_bucket(file_buffer, file_path, content_type="application/pdf", metadata=None):
     bucket = storage_client.bucket(CERTIFICATES_BUCKET)
     blob = bucket.blob(file_path)
+    if metadata:
+        blob.metadata = metadata
     blob.upload_from_file(file_buffer, rewind=True, content_type=content_type)
     return blob
 
-def get_from_bucket(file_path) -> Blob:
+# Source uploads run here, alongside the PDF conversion of the same row. Sized so every
+# row converting in the instance has its upload thread (created on demand), otherwise
+# uploads queue behind other requests' and the rows wait for them
+source_upload_executor = ThreadPoolExecutor(max_workers=REQUEST_CONCURRENCY * BATCH_MAX_WORKERS, thread_name_prefix='source-upload')
+
+# Rows of batch requests run here rather than in a pool per request, so the threads (and
+# the Drive service each of them keeps) outlive the request. Each batch request still uses
+# at most BATCH_MAX_WORKERS of them
+batch_row_executor = ThreadPoolExecutor(max_workers=REQUEST_CONCURRENCY * BATCH_MAX_WORKERS, thread_name_prefix='batch-row')
+
+def get_from_bucket(file_path, generation=None) -> Blob:
     bucket = storage_client.bucket(CERTIFICATES_BUCKET)
-    blob = bucket.blob(file_path)
+    blob = bucket.blob(file_path, generation=generation)
     return blob
 
-CACHE = {}
-IN_FLIGHT = {}
+class LRUCache:
+    """
+    Least-recently-used cache bounded by the total size (in bytes) of its entries,
+    with an optional TTL. Not thread-safe: callers must hold LOCK.
+    """
+    def __init__(self, max_bytes, ttl_seconds=0):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds # 0 disables expiration
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (value, size, stored_at)
+
+    def get(self, key, is_valid=None):
+        """
+        Returns the value, or None on a miss. Expired entries are dropped. Entries that fail
+        `is_valid` are a miss but stay cached: another caller may still want them.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, _, stored_at = entry
+            expired = self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds
+            if expired:
+                self._remove(key)
+            elif not is_valid or is_valid(value):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def peek(self, key):
+        """Returns the value without counting a hit or refreshing its position."""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, value, size):
+        if key in self._entries:
+            self._remove(key)
+
+        if size > self.max_bytes:
+            print(f"Cache entry {key} ({size} bytes) is larger than the cache budget, not caching it")
+            return
+
+        self._entries[key] = (value, size, time.monotonic())
+        self.total_bytes += size
+
+        while self.total_bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+            print(f"Cache evicted {oldest_key}")
+
+    def remove(self, key):
+        if key in self._entries:
+            self._remove(key)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+CACHE = LRUCache(TEMPLATE_CACHE_MAX_BYTES, TEMPLATE_CACHE_TTL_SECONDS)
+IN_FLIGHT = {} # {(url, generation): {"event", "plan"}}, one download per template generation
 LOCK = Lock()
 
-def get_template_cached(storage_file_url: str) -> bytes:
+def get_template_cached(storage_file_url: str, is_docx: bool, expected_generation: Optional[str] = None) -> TemplatePlan:
+    """
+    Returns the compiled TemplatePlan of the template, downloading and compiling it
+    only once per GCS generation (concurrent requests wait for the elected downloader).
+
+    With `expected_generation` (sent in the task payload), the cached plan is used without
+    any GCS call if it matches. Otherwise the template's current generation is read from
+    GCS first, unless the cached plan was checked less than TEMPLATE_REVALIDATE_SECONDS ago.
+    """
     thread_name = current_thread().name
     print(f"[{thread_name}] Requesting template: {storage_file_url}")
 
-    template_blob = get_from_bucket(storage_file_url)
-    template_blob.reload()
-    generation = str(template_blob.generation)
-
     with LOCK:
-        cached = CACHE.get(storage_file_url)
-        if cached and cached["generation"] == generation:
-            print(f"[{thread_name}] CACHE HIT (generation={generation})")
-            return cached["bytes"]
+        if expected_generation:
+            cached = CACHE.get(storage_file_url, lambda entry: entry["generation"] == expected_generation)
+        else:
+            cached = CACHE.peek(storage_file_url)
+            recently_checked = cached and time.monotonic() - cached["checked_at"] < TEMPLATE_REVALIDATE_SECONDS
+            cached = CACHE.get(storage_file_url) if recently_checked else None
+
+        if cached:
+            print(f"[{thread_name}] CACHE HIT (generation={cached['generation']}) {CACHE.stats()}")
+            return cached["plan"]
 
-        print(f"[{thread_name}] CACHE MISS")
+    if expected_generation:
+        template_blob = get_from_bucket(storage_file_url, generation=int(expected_generation))
+        generation = expected_generation
+    else:
+        template_blob = get_from_bucket(storage_file_url)
+        template_blob.reload()
+        generation = str(template_blob.generation)
 
-        if storage_file_url in IN_FLIGHT:
+    with LOCK:
+        if not expected_generation:
+            # The generation was just checked against GCS
+            cached = CACHE.get(storage_file_url, lambda entry: entry["generation"] == generation)
+            if cached:
+                cached["checked_at"] = time.monotonic()
+                print(f"[{thread_name}] CACHE HIT (generation={generation}) {CACHE.stats()}")
+                return cached["plan"]
+
+        print(f"[{thread_name}] CACHE MISS {CACHE.stats()}")
+
+        # Only a download of the same generation can be shared
+        in_flight_key = (storage_file_url, generation)
+        if in_flight_key in IN_FLIGHT:
             print(f"[{thread_name}] Another thread is downloading → waiting")
-            event = IN_FLIGHT[storage_file_url]
+            in_flight = IN_FLIGHT[in_flight_key]
             is_downloader = False
         else:
             print(f"[{thread_name}] Elected as downloader")
-            event = Event()
-            IN_FLIGHT[storage_file_url] = event
+            in_flight = {"event": Event(), "plan": None}
+            IN_FLIGHT[in_flight_key] = in_flight
             is_downloader = True
 
     # 🔹 Threads that DO NOT download wait here
+    # (they read the downloader's result directly: the entry may not fit in the cache)
     if not is_downloader:
-        event.wait()
-        print(f"[{thread_name}] Download finished → reading from cache")
-        return CACHE[storage_file_url]["bytes"]
+        in_flight["event"].wait()
+        if in_flight["plan"] is None:
+            raise RuntimeError(f"Template download failed in another thread: {storage_file_url}")
+        print(f"[{thread_name}] Download finished → reading downloader's result")
+        return in_flight["plan"]
 
     # 🔹 Only ONE thread arrives here
     try:
         print(f"[{thread_name}] Downloading template (generation={generation})")
         template_bytes = template_blob.download_as_bytes()
+        template_plan = compile_template_plan(template_bytes, is_docx)
+        print(f"[{thread_name}] Template compiled ({len(template_plan.blocks)} Liquid blocks)")
 
         with LOCK:
-            CACHE[storage_file_url] = {
-                "generation": generation,
-                "bytes": template_bytes
-            }
-            print(f"[{thread_name}] Cache updated")
+            # A request for an older generation must not replace a newer cached plan
+            cached = CACHE.peek(storage_file_url)
+            if cached is None or int(cached["generation"]) <= int(generation):
+                CACHE.put(storage_file_url, {
+                    "generation": generation,
+                    "plan": template_plan,
+                    "checked_at": time.monotonic(),
+                }, template_plan.size_bytes)
+                print(f"[{thread_name}] Cache updated {CACHE.stats()}")
+            in_flight["plan"] = template_plan
     finally:
         with LOCK:
-            event.set()
-            IN_FLIGHT.pop(storage_file_url, None)
+            in_flight["event"].set()
+            IN_FLIGHT.pop(in_flight_key, None)
             print(f"[{thread_name}] Released waiting threads")
 
-    return template_bytes
+    return template_plan
 
 
 #################################### Functions to call backend endpoints ####################################
+backend_client = BackendClient(
+    APP_BASE_URL,
+    AUDIENCE,
+    use_id_token=ENV != 'local',
+    pool_maxsize=BACKEND_POOL_MAXSIZE,
+)
+
 def finish_certificates_generation(data_source_row_id, success, total_bytes=None, user_id=None):
     print('Inside update')
-    url = f"{APP_BASE_URL}/api/internal/data-source-rows/{data_source_row_id}/generations"
-
-    if ENV != 'local':
-        auth_req = google.auth.transport.requests.Request()
-        # Just works for service accounts or in the cloud. Locally, I need to login impersonating a service account.
-        id_token = google.oauth2.id_token.fetch_id_token(auth_req, AUDIENCE)
-
-        headers = {
-            "Authorization": f"Bearer {id_token}",
-            "Content-Type": "application/json",
-        }
-    else:
-        headers = {
-            "Content-Type": "application/json",
-        }
-    
     body = {k: v for k, v in {
         "success": success,
         "totalBytes": total_bytes,
@@ -536,8 +943,118 @@ def finish_certificates_generation(data_source_row_id, success, total_bytes=None
     }.items() if v is not None}
 
     print('before sending patch')
-    response = requests.patch(url, json=body, headers=headers)
-    response.raise_for_status()
+    backend_client.patch(f"/api/internal/data-source-rows/{data_source_row_id}/generations", body)
+
+# Flipped once the backend answers 404/405 to the bulk route (older deployment)
+bulk_generations_supported = True
+
+class GenerationReporter:
+    """
+    Buffers the row outcomes of one batch request and reports them through the bulk
+    `/api/internal/data-source-rows/generations` endpoint, so the backend gets one write
+    per `batch_size` rows instead of one per row.
+
+    Pending outcomes are flushed when `batch_size` of them are buffered, when the oldest
+    one has waited `flush_seconds` (0 flushes on every report), and on close(). When the
+    bulk call itself could not be made (endpoint missing or request failed), its rows
+    fall back to finish_certificates_generation, one call each. So do the rows the bulk
+    endpoint rejected as retryable (e.g. a database timeout); rows it rejected with a
+    domain error are not resent, since the per-row route would reject them too.
+    """
+
+    def __init__(self, batch_size, flush_seconds):
+        self.batch_size = max(batch_size, 1)
+        self.flush_seconds = flush_seconds
+
+        self._pending = []
+        self._oldest_at = None
+        self._errors = {} # {rowId: {"error": str, "retryable": bool}}
+        self._lock = Lock()
+        self._closed = Event()
+        self._flusher = None
+        if flush_seconds > 0:
+            self._flusher = Thread(target=self._flush_periodically, name='generation-reporter', daemon=True)
+            self._flusher.start()
+
+    def report(self, data_source_row_id, success, total_bytes=None, user_id=None):
+        generation = {k: v for k, v in {
+            "dataSourceRowId": data_source_row_id,
+            "success": success,
+            "totalBytes": total_bytes,
+            "userId": user_id,
+        }.items() if v is not None}
+
+        with self._lock:
+            if not self._pending:
+                self._oldest_at = time.monotonic()
+            self._pending.append(generation)
+            is_full = len(self._pending) >= self.batch_size
+
+        if is_full or self._flusher is None:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch = self._pending
+            self._pending = []
+            self._oldest_at = None
+
+        if batch:
+            self._send(batch)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(min(self.flush_seconds, 0.5)):
+            with self._lock:
+                is_due = self._oldest_at is not None and time.monotonic() - self._oldest_at >= self.flush_seconds
+            if is_due:
+                self.flush()
+
+    def _send(self, batch):
+        global bulk_generations_supported
+
+        fallback = batch
+        if bulk_generations_supported:
+            try:
+                response = backend_client.post("/api/internal/data-source-rows/generations", {"generations": batch})
+                rejected = {r["dataSourceRowId"]: r for r in response.json()["results"] if not r["success"]}
+                # Older backends do not say whether a rejection is final: resend those too
+                fallback = [g for g in batch if g["dataSourceRowId"] in rejected and rejected[g["dataSourceRowId"]].get("retryable", True)]
+                with self._lock:
+                    for row_id, result in rejected.items():
+                        if not result.get("retryable", True):
+                            self._errors[row_id] = {"error": result.get("error") or "Rejected by the backend", "retryable": False}
+                print(f"Reported {len(batch) - len(rejected)} generations in bulk, {len(rejected)} rejected ({len(fallback)} to resend)")
+            except HTTPError as e:
+                if e.response is not None and e.response.status_code in (404, 405):
+                    print("Bulk generations endpoint not available, reporting rows one by one")
+                    bulk_generations_supported = False
+                else:
+                    print("Bulk generations report failed:", str(e))
+            except Exception as e:
+                print("Bulk generations report failed:", str(e))
+
+        for generation in fallback:
+            try:
+                finish_certificates_generation(
+                    generation["dataSourceRowId"],
+                    generation["success"],
+                    generation.get("totalBytes"),
+                    generation.get("userId"),
+                )
+            except Exception as e:
+                with self._lock:
+                    self._errors[generation["dataSourceRowId"]] = {"error": str(e), "retryable": True}
+
+    def close(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Flushes what is left and returns the rows that could not be reported, with the
+        error and whether reporting them again may succeed.
+        """
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        return dict(self._errors)
 
 
 
@@ -567,6 +1084,7 @@ class TemplateModel(BaseModel):
     storageFileUrl: Optional[str] = None
     fileMimeType: TemplateFileMimeType
     variables: List[str]
+    generation: Optional[Union[int, str]] = None # GCS generation of the template, skips revalidating the cache
 
 class ColumnType(str, Enum):
     STRING = "string"
@@ -604,9 +1122,594 @@ class TriggerGenerateCertificatePDFsInput(BaseModel):
     certificateEmission: CertificateEmissionModel
     row: DataSourceRowModel
 
+class TriggerGenerateCertificatePDFsBatchInput(BaseModel):
+    certificateEmission: CertificateEmissionModel
+    rows: List[DataSourceRowModel]
+
+class ExportCertificatesInput(BaseModel):
+    userId: str
+    certificateEmissionId: str
+    rowIds: Optional[List[str]] = None # All the generated certificates when not given
+
 class NonRetryableError(Exception):
     """Raised for errors that retrying will never fix (bad input, unsupported business case)."""
 
+
+#################################### Certificate generation ####################################
+def resolve_template_file_extension(file_mime_type):
+    """Returns (is_docx, file_extension_str) for the template mime type."""
+    if file_mime_type in [DOCX_MIME_TYPE, GOOGLE_DOCS_MIME_TYPE]:
+        return True, 'docx'
+    elif file_mime_type in [PPTX_MIME_TYPE, GOOGLE_SLIDES_MIME_TYPE]:
+        return False, 'pptx'
+    raise NonRetryableError(f'Unsupported template file extension: {file_mime_type}')
+
+def template_generation(template: TemplateModel) -> Optional[str]:
+    return str(template.generation) if template.generation is not None else None
+
+BR_REGEX = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})(?: (\d{2}):(\d{2})(?::(\d{2}))?)?$')
+
+def convert_boolean(item: str):
+    return item.lower() in ("true", "verdadeiro", "1")
+
+def convert_date(item: str):
+    regex_match = BR_REGEX.match(item)
+
+    if regex_match:
+        day = int(regex_match.group(1))
+        month = int(regex_match.group(2))
+        year = int(regex_match.group(3))
+        hour = int(regex_match.group(4)) if regex_match.group(4) else None
+        minute = int(regex_match.group(5)) if regex_match.group(5) else None
+        second = int(regex_match.group(6)) if regex_match.group(6) else None
+
+        if month > 12:
+            aux = day
+            day = month
+            month = aux
+
+        if second != None:
+            dt = datetime(year, month, day, hour, minute, second)
+            return LiquidDate(dt.strftime("%d/%m/%Y %H:%M:%S"), dt)
+        elif hour != None or minute != None:
+            dt = datetime(year, month, day, hour, minute)
+            return LiquidDate(dt.strftime("%d/%m/%Y %H:%M"), dt)
+        else:
+            dt = datetime(year, month, day)
+            return LiquidDate(dt.strftime("%d/%m/%Y"), dt)
+
+    return item
+
+def convert_string(item: str):
+    return item
+
+ITEM_CONVERTERS = {
+    'boolean': convert_boolean,
+    'number': LiquidFloat,
+    'date': convert_date,
+}
+
+def build_column_converter(column: Column):
+    """Returns the function that turns a stripped cell of `column` into its template value."""
+    if column.type != ColumnType.ARRAY:
+        return ITEM_CONVERTERS.get(column.type.value, convert_string)
+
+    if column.arrayMetadata is None:
+        def convert_array_without_metadata(value: str):
+            raise NonRetryableError(f"Array column '{column.name}' has no arrayMetadata")
+        return convert_array_without_metadata
+
+    separator = column.arrayMetadata.separator
+    convert_item = ITEM_CONVERTERS.get(column.arrayMetadata.itemType.value, convert_string)
+
+    def convert_array(value: str):
+        return [convert_item(item.strip()) for item in value.split(separator) if item.strip()]
+    return convert_array
+
+class RowConverter:
+    """
+    Turns `row.data` into the variables of the template. Built once per emission: the
+    template variable -> column lookup and the converter of each column are resolved
+    here, so converting a row only walks the mapped fields.
+    """
+
+    def __init__(self, certificate_emission: CertificateEmissionModel):
+        columns_by_name = {}
+        for column in certificate_emission.dataSource.columns:
+            columns_by_name.setdefault(column.name, column) # First column wins, as the old linear scan did
+
+        self.fields = []
+        for template_var, column_name in (certificate_emission.variableColumnMapping or {}).items():
+            column = columns_by_name.get(column_name) if column_name else None
+            if column is not None:
+                self.fields.append((template_var, column_name, build_column_converter(column)))
+
+    def convert(self, row: DataSourceRowModel) -> Dict[str, Any]:
+        data = row.data
+        row_variable_mapping = {}
+        for template_var, column_name, convert in self.fields:
+            if column_name in data:
+                row_variable_mapping[template_var] = convert(data[column_name].strip())
+        return row_variable_mapping
+
+    def convert_rows(self, rows: List[DataSourceRowModel]) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        Columnar version of convert() for a batch: each mapped column is converted for
+        all rows at once, and every distinct cell value is converted only once (spreadsheets
+        repeat dates, grades and flags a lot). Values are still parsed cell by cell, with
+        the exact rules of convert(), so the result matches converting each row on its own.
+
+        A row whose conversion failed gets the exception convert() would have raised,
+        the other rows are not affected.
+        """
+        results: List[Union[Dict[str, Any], Exception]] = [{} for _ in rows]
+
+        for template_var, column_name, convert in self.fields:
+            converted_values = {}
+            for index, row in enumerate(rows):
+                row_variable_mapping = results[index]
+                if isinstance(row_variable_mapping, Exception) or column_name not in row.data:
+                    continue
+
+                raw_value = row.data[column_name]
+                try:
+                    succeeded, value = converted_values[raw_value]
+                except KeyError:
+                    try:
+                        succeeded, value = True, convert(raw_value.strip())
+                    except Exception as e:
+                        succeeded, value = False, e
+                    converted_values[raw_value] = (succeeded, value)
+                except TypeError:
+                    # Unhashable cell (not a string), convert it without caching
+                    try:
+                        succeeded, value = True, convert(raw_value.strip())
+                    except Exception as e:
+                        succeeded, value = False, e
+
+                if not succeeded:
+                    results[index] = value
+                else:
+                    # Arrays are per row, the converted items inside them can be shared
+                    row_variable_mapping[template_var] = list(value) if isinstance(value, list) else value
+
+        return results
+
+class CertificateIndex:
+    """
+    Process-local index of the certificates already produced, by content key (see
+    certificate_content_key), bounded to the most recent `max_entries`.
+
+    Also a single flight: while a key is being produced, other rows with the same key
+    wait for it and then copy the result, instead of rendering the same thing.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # {key: {"pdf": (path, generation), "source": (path, generation) | None}}
+        self._in_flight = {} # {key: Event}
+        self._lock = Lock()
+
+    def acquire(self, key):
+        """
+        Returns the entry of `key` if it was produced already. Otherwise returns None and
+        the caller becomes its producer, and must call release().
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry
+
+                event = self._in_flight.get(key)
+                if event is None:
+                    self._in_flight[key] = Event()
+                    return None
+
+            # If the producer fails, the next waiter takes its place
+            event.wait()
+
+    def release(self, key, entry=None):
+        with self._lock:
+            if entry is not None:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            event = self._in_flight.pop(key, None)
+
+        if event is not None:
+            event.set()
+
+    def forget(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+certificate_index = CertificateIndex(CERTIFICATE_INDEX_MAX_ENTRIES)
+
+def canonical_context_value(value):
+    if isinstance(value, LiquidFloat):
+        return ["number", str(value.display), value.dec_sep, value.thousands_sep, repr(float(value))]
+    if isinstance(value, LiquidDate):
+        return ["date", str(value.display), value.isoformat()]
+    if isinstance(value, bool):
+        return ["boolean", value]
+    if isinstance(value, list):
+        return ["array", [canonical_context_value(item) for item in value]]
+    return [type(value).__name__, str(value)]
+
+def certificate_content_key(user_id, template_plan: TemplatePlan, row_variable_mapping: Dict[str, Any]) -> Optional[str]:
+    """
+    Hash of everything the certificate's content depends on: the template bytes, the
+    converted row variables and the PDF engine. None when the template output also
+    depends on the time of rendering. Scoped by user, so copies never cross accounts.
+    """
+    if not template_plan.is_deterministic:
+        return None
+
+    context = sorted((name, canonical_context_value(value)) for name, value in row_variable_mapping.items())
+    payload = json.dumps([user_id, template_plan.template_hash, PDF_CONVERTER, context], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def index_entry(pdf_blob: Blob, source_blob: Optional[Blob]):
+    """CertificateIndex entry pinning the exact generations that were produced."""
+    return {
+        "pdf": (pdf_blob.name, pdf_blob.generation),
+        "source": (source_blob.name, source_blob.generation) if source_blob is not None else None,
+    }
+
+def copy_certificate(entry, pdf_path, source_path) -> Optional[Blob]:
+    """
+    Reuses an already produced certificate with server-side copies. Returns the PDF blob,
+    or None if any of the recorded generations is gone: regenerating a row overwrites
+    its objects, and the newer ones may hold another row's content.
+    """
+    bucket = storage_client.bucket(CERTIFICATES_BUCKET)
+    entry_pdf_path, entry_pdf_generation = entry["pdf"]
+
+    if source_path and not entry["source"]:
+        return None
+
+    if entry_pdf_path == pdf_path:
+        # Same row again: the objects are in place if nothing overwrote them since
+        pdf_blob = bucket.get_blob(pdf_path)
+        if pdf_blob is None or pdf_blob.generation != entry_pdf_generation:
+            return None
+        if source_path:
+            source_blob = bucket.get_blob(source_path)
+            if source_blob is None or source_blob.generation != entry["source"][1]:
+                return None
+        return pdf_blob
+
+    try:
+        if source_path:
+            entry_source_path, entry_source_generation = entry["source"]
+            bucket.copy_blob(bucket.blob(entry_source_path), bucket, source_path, source_generation=entry_source_generation)
+        return bucket.copy_blob(bucket.blob(entry_pdf_path), bucket, pdf_path, source_generation=entry_pdf_generation)
+    except NotFound:
+        return None
+
+# Object metadata with the hash of the document a certificate was produced from
+RENDERED_HASH_METADATA_KEY = 'renderedContentHash'
+
+def rendered_content_hash(certificate_bytes: bytes) -> str:
+    digest = hashlib.sha256(certificate_bytes)
+    digest.update(PDF_CONVERTER.encode('utf-8'))
+    return digest.hexdigest()
+
+def has_rendered_hash(blob: Optional[Blob], rendered_hash) -> bool:
+    return blob is not None and (blob.metadata or {}).get(RENDERED_HASH_METADATA_KEY) == rendered_hash
+
+def find_converted_certificate(pdf_path, source_path, certificate_bytes, source_mime, metadata):
+    """
+    Returns the (PDF, source) blobs at `pdf_path`/`source_path` if a previous attempt
+    already converted this exact rendered document (see RENDERED_HASH_METADATA_KEY),
+    else None. A missing or stale source file is uploaded again, which is cheap next to
+    a conversion.
+    """
+    bucket = storage_client.bucket(CERTIFICATES_BUCKET)
+    rendered_hash = metadata[RENDERED_HASH_METADATA_KEY]
+
+    pdf_blob = bucket.get_blob(pdf_path)
+    if not has_rendered_hash(pdf_blob, rendered_hash):
+        return None
+
+    source_blob = None
+    if source_path:
+        source_blob = bucket.get_blob(source_path)
+        if not has_rendered_hash(source_blob, rendered_hash):
+            source_blob = upload_to_bucket(BytesIO(certificate_bytes), source_path, content_type=source_mime, metadata=metadata)
+    return pdf_blob, source_blob
+
+def render_and_convert_certificate(template_plan: TemplatePlan, row_variable_mapping, has_variables, is_docx, file_extension_str, pdf_path, source_path, is_retry=False):
+    """Returns the uploaded (PDF, source) blobs, source being None without UPLOAD_SOURCE_FILE."""
+    if has_variables:
+        certificate_buffer = render_template_plan(template_plan, row_variable_mapping)
+    else:
+        certificate_buffer = BytesIO(template_plan.template_bytes)
+    
+    # Each consumer gets its own buffer over the same immutable bytes, so the source
+    # upload and the conversion can read concurrently without sharing a cursor
+    certificate_bytes = certificate_buffer.getvalue()
+    rendered_hash = rendered_content_hash(certificate_bytes)
+    metadata = {RENDERED_HASH_METADATA_KEY: rendered_hash}
+    source_mime = DOCX_MIME_TYPE if is_docx else PPTX_MIME_TYPE
+
+    if is_retry:
+        # Rendering is deterministic, so the hash tells whether an earlier attempt that
+        # failed later on (e.g. in the backend callback) already produced this PDF
+        converted = find_converted_certificate(pdf_path, source_path, certificate_bytes, source_mime, metadata)
+        if converted is not None:
+            print(f'{pdf_path} was already converted from this document by a previous attempt')
+            return converted
+
+    source_upload = None
+    if source_path:
+        source_upload = source_upload_executor.submit(
+            upload_to_bucket, BytesIO(certificate_bytes), source_path, content_type=source_mime, metadata=metadata
+        )
+
+    try:
+        pdf_buffer = pdf_converter.convert(BytesIO(certificate_bytes), file_extension_str)
+        pdf_blob = upload_to_bucket(pdf_buffer, pdf_path, metadata=metadata)
+    finally:
+        # Never leave the upload running past the request, even when the conversion failed
+        if source_upload is not None:
+            wait([source_upload])
+
+    source_blob = source_upload.result() if source_upload is not None else None
+    return pdf_blob, source_blob
+
+def generate_certificate(certificate_emission: CertificateEmissionModel, row: DataSourceRowModel, template_plan: TemplatePlan, row_variable_mapping: Dict[str, Any], is_retry=False) -> Blob:
+    """
+    Renders, uploads and converts the certificate of a single row. Returns the uploaded PDF blob.
+    The rendered source file is uploaded while the PDF conversion runs.
+
+    A row whose content was already produced (same template and variables) gets copies
+    of those objects instead, see CertificateIndex. On a Cloud Tasks retry, a PDF that a
+    previous attempt converted from the same rendered document is kept as is.
+    """
+    certificate_emission_id = certificate_emission.id
+    user_id = certificate_emission.userId
+    data_source_row_id = row.id
+    is_docx, file_extension_str = resolve_template_file_extension(certificate_emission.template.fileMimeType.value)
+
+    print(f'Generating certificate for row {data_source_row_id}: ', row)
+    has_variables = bool(certificate_emission.variableColumnMapping)
+    pdf_path = f"users/{user_id}/certificates/{certificate_emission_id}/certificate-{data_source_row_id}.pdf"
+    source_path = f"users/{user_id}/certificates/{certificate_emission_id}/certificate-{data_source_row_id}.{file_extension_str}" if UPLOAD_SOURCE_FILE else None
+
+    content_key = None
+    if CERTIFICATE_DEDUPLICATION:
+        content_key = certificate_content_key(user_id, template_plan, row_variable_mapping if has_variables else {})
+
+    if content_key is None:
+        pdf_blob, _ = render_and_convert_certificate(template_plan, row_variable_mapping, has_variables, is_docx, file_extension_str, pdf_path, source_path, is_retry)
+        return pdf_blob
+
+    while True:
+        entry = certificate_index.acquire(content_key)
+        if entry is None:
+            break
+
+        pdf_blob = copy_certificate(entry, pdf_path, source_path)
+        if pdf_blob is not None:
+            print(f'Row {data_source_row_id} has the same content as {entry["pdf"][0]}, copied it')
+            return pdf_blob
+        certificate_index.forget(content_key, entry)
+
+    produced_entry = None
+    try:
+        pdf_blob, source_blob = render_and_convert_certificate(template_plan, row_variable_mapping, has_variables, is_docx, file_extension_str, pdf_path, source_path, is_retry)
+        produced_entry = index_entry(pdf_blob, source_blob)
+        return pdf_blob
+    finally:
+        certificate_index.release(content_key, produced_entry)
+
+def format_pydantic_errors(errors):
+    formatted_errors = []
+
+    for error in errors:
+        field = ".".join([str(x) for x in error['loc']])
+        message = error['msg']
+        formatted_errors.append({
+            "field": field,
+            "message": message
+        })
+
+    return formatted_errors
+
+def generate_certificates_batch(raw_data, is_last_attempt, is_retry, retry_count_header):
+    """
+    Handles a TriggerGenerateCertificatePDFsBatchInput: the template is fetched once
+    and every row is rendered against it. Row outcomes are reported to the backend in
+    bulk by a GenerationReporter, and the response carries a per-row result list.
+
+    If any row failed with a retryable error (and this is not the last attempt), a 500 is
+    returned so Cloud Tasks retries the batch.
+    """
+    try:
+        input_data = TriggerGenerateCertificatePDFsBatchInput(**raw_data)
+    except ValidationError as e:
+        friendly_errors = format_pydantic_errors(e.errors())
+        print("Validation errors:", friendly_errors)
+        return {"error": friendly_errors}, 200
+
+    certificate_emission = input_data.certificateEmission
+    user_id = certificate_emission.userId
+    rows = input_data.rows
+
+    reporter = GenerationReporter(GENERATION_REPORT_BATCH_SIZE, GENERATION_REPORT_FLUSH_SECONDS)
+
+    try:
+        is_docx, _ = resolve_template_file_extension(certificate_emission.template.fileMimeType.value)
+
+        print('Loading template from bucket: ', certificate_emission.template.storageFileUrl)
+        template_plan = get_template_cached(
+            certificate_emission.template.storageFileUrl,
+            is_docx,
+            expected_generation=template_generation(certificate_emission.template),
+        )
+    except NonRetryableError as e:
+        print('Non-retryable error:', str(e))
+        for row in rows:
+            reporter.report(row.id, False)
+        reporter.close()
+
+        return {
+            'title': 'Failed to generate certificates',
+            'details': str(e)
+        }, 200
+    except Exception as e:
+        print('Error loading template for batch:', str(e))
+        if is_last_attempt:
+            for row in rows:
+                reporter.report(row.id, False)
+        reporter.close()
+
+        return {
+            'title': 'Failed to generate certificates',
+            'details': str(e)
+        }, 500
+
+    row_variable_mappings = RowConverter(certificate_emission).convert_rows(rows)
+
+    def process_row(index: int):
+        row = rows[index]
+        try:
+            row_variable_mapping = row_variable_mappings[index]
+            if isinstance(row_variable_mapping, Exception):
+                raise row_variable_mapping
+
+            blob = generate_certificate(certificate_emission, row, template_plan, row_variable_mapping, is_retry)
+            reporter.report(row.id, True, blob.size, user_id)
+            return {"rowId": row.id, "success": True}
+
+        except NonRetryableError as e:
+            print(f'Non-retryable error for row {row.id}:', str(e))
+            reporter.report(row.id, False)
+            return {"rowId": row.id, "success": False, "retryable": False, "details": str(e)}
+
+        except Exception as e:
+            if is_last_attempt:
+                reporter.report(row.id, False)
+
+            print(f'Error for row {row.id}:', str(e))
+            return {"rowId": row.id, "success": False, "retryable": not is_last_attempt, "details": str(e)}
+
+    results = [None] * len(rows)
+    row_indexes = iter(range(len(rows)))
+    row_indexes_lock = Lock()
+
+    def process_rows():
+        while True:
+            with row_indexes_lock:
+                index = next(row_indexes, None)
+            if index is None:
+                return
+            results[index] = process_row(index)
+
+    workers = [batch_row_executor.submit(process_rows) for _ in range(min(BATCH_MAX_WORKERS, len(rows)))]
+    for worker in workers:
+        worker.result()
+
+    update_errors = reporter.close()
+    for result in results:
+        update_error = update_errors.get(result["rowId"])
+        if not update_error:
+            continue
+
+        if result["success"]:
+            # The certificate exists but the backend does not know it yet: retry the row,
+            # unless the backend rejected it (retrying would fail the same way)
+            result.update(
+                success=False,
+                retryable=update_error["retryable"] and not is_last_attempt,
+                details=f'Update error: {update_error["error"]}',
+            )
+        else:
+            result["details"] = f'Original error: {result["details"]}; Update error: {update_error["error"]}'
+
+    failed = [r for r in results if not r["success"]]
+    print(f'Batch finished: {len(results) - len(failed)} succeeded, {len(failed)} failed')
+
+    if any(r["retryable"] for r in failed):
+        print(f'Retryable errors on attempt {retry_count_header}, Cloud Tasks will retry the batch.')
+        return {
+            'title': 'Failed to generate some certificates',
+            'results': results
+        }, 500
+
+    return {"results": results}, 200
+
+#################################### Certificates export ####################################
+def certificates_prefix(user_id, certificate_emission_id):
+    return f"users/{user_id}/certificates/{certificate_emission_id}/"
+
+def list_certificate_pdfs(user_id, certificate_emission_id, row_ids=None) -> List[Blob]:
+    prefix = certificates_prefix(user_id, certificate_emission_id)
+    if row_ids is not None:
+        bucket = storage_client.bucket(CERTIFICATES_BUCKET)
+        return [bucket.blob(f"{prefix}certificate-{row_id}.pdf") for row_id in row_ids]
+
+    return [
+        blob for blob in storage_client.list_blobs(CERTIFICATES_BUCKET, prefix=f"{prefix}certificate-")
+        if blob.name.endswith('.pdf')
+    ]
+
+def stream_certificates_zip(pdf_blobs, output_stream):
+    """
+    Writes the PDFs into a zip on `output_stream`, reading each blob in chunks, so memory
+    stays at a couple of chunks whatever the number or size of the certificates. The
+    output does not need to be seekable (sizes go in data descriptors). Missing blobs
+    are skipped. Returns (files written, uncompressed bytes).
+    """
+    files_count = 0
+    total_bytes = 0
+
+    with zipfile.ZipFile(output_stream, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for blob in pdf_blobs:
+            file_name = blob.name.rsplit('/', 1)[-1]
+            try:
+                source = blob.open('rb', chunk_size=EXPORT_READ_CHUNK_BYTES)
+                # Read before creating the entry, so a missing blob leaves no empty file behind
+                chunk = source.read(EXPORT_READ_CHUNK_BYTES)
+            except NotFound:
+                print(f"Certificate {blob.name} not found, skipping it")
+                continue
+
+            with source, zip_file.open(file_name, 'w', force_zip64=True) as target:
+                while chunk:
+                    target.write(chunk)
+                    total_bytes += len(chunk)
+                    chunk = source.read(EXPORT_READ_CHUNK_BYTES)
+            files_count += 1
+
+    return files_count, total_bytes
+
+def export_certificates_zip(user_id, certificate_emission_id, row_ids=None):
+    """
+    Streams the emission's PDFs into a single zip in the bucket, uploaded with a resumable
+    upload as it is written. Returns the blob of the zip and the number of files in it.
+    """
+    pdf_blobs = list_certificate_pdfs(user_id, certificate_emission_id, row_ids)
+
+    # The suffix keeps two exports started in the same second from overwriting each other
+    export_name = f"certificates-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.zip"
+    export_path = f"{certificates_prefix(user_id, certificate_emission_id)}exports/{export_name}"
+    export_blob = storage_client.bucket(CERTIFICATES_BUCKET).blob(export_path)
+
+    print(f"Exporting {len(pdf_blobs)} certificates to {export_path}")
+    # zipfile flushes on close, which a resumable upload cannot do before its last chunk
+    with export_blob.open('wb', chunk_size=EXPORT_UPLOAD_CHUNK_BYTES, ignore_flush=True, content_type='application/zip') as output_stream:
+        files_count, total_bytes = stream_certificates_zip(pdf_blobs, output_stream)
+
+    print(f"Exported {files_count} certificates ({total_bytes} bytes before compression)")
+    return export_blob, files_count
+
+
 @functions_framework.http
 def main(request):
     print('Generate PDFs function invoked via Pub/Sub Push')
@@ -616,145 +1719,39 @@ def main(request):
 
     retry_count_header = request.headers.get('X-CloudTasks-TaskRetryCount')
     is_last_attempt = retry_count_header is None or (int(retry_count_header) + 1) >= MAX_ATTEMPTS
+    is_retry = retry_count_header is not None and int(retry_count_header) > 0
 
     try:
         raw_data = request.get_json(silent=True)
         if raw_data is None:
             raise NonRetryableError('JSON body is required')
 
+        if 'rows' in raw_data:
+            return generate_certificates_batch(raw_data, is_last_attempt, is_retry, retry_count_header)
+
         data_source_row_id = raw_data.get('row', {}).get('id')
 
         input_data = TriggerGenerateCertificatePDFsInput(**raw_data)
         
         certificate_emission = input_data.certificateEmission
-        certificate_emission_id = certificate_emission.id
         template = certificate_emission.template
-        data_source = certificate_emission.dataSource
-        variable_mapping = certificate_emission.variableColumnMapping or {}
         row = input_data.row
         data_source_row_id = row.id
         user_id = certificate_emission.userId
-        # input_method = template.inputMethod.value
-        file_mime_type = template.fileMimeType.value
-
-        template_buffer = None
-        is_docx = None
-
-        if file_mime_type in [DOCX_MIME_TYPE, GOOGLE_DOCS_MIME_TYPE]:
-            is_docx = True
-            file_extension_str = 'docx'
-        elif file_mime_type in [PPTX_MIME_TYPE, GOOGLE_SLIDES_MIME_TYPE]:
-            is_docx = False
-            file_extension_str = 'pptx'
-        else:
-            raise NonRetryableError(f'Unsupported template file extension: {file_mime_type}')
 
-        print('Loading template from bucket: ', template.storageFileUrl)
-        template_bytes = get_template_cached(template.storageFileUrl)
-        template_buffer = BytesIO(template_bytes)
-
-        print(f'Generating certificate for row {data_source_row_id}: ', row)
-        certificate_buffer = BytesIO(template_buffer.getvalue())
-
-        print('variable_mapping: ', variable_mapping)
-        if variable_mapping:
-            row_variable_mapping = {}
-            for template_var, column_name in variable_mapping.items():
-                if column_name and column_name in row.data:
-                    for column in data_source.columns:
-                        if column.name == column_name:
-                            def convert_item(item: str, item_type: str):
-                                match item_type:
-                                    case 'boolean':
-                                        return item.lower() in ("true", "verdadeiro", "1")
-                                    case 'number':
-                                        return LiquidFloat(item)
-                                    case 'date':
-                                        BR_REGEX = re.compile(
-                                            r'^(\d{1,2})/(\d{1,2})/(\d{4})(?: (\d{2}):(\d{2})(?::(\d{2}))?)?$'
-                                        )
-
-                                        regex_match = BR_REGEX.match(item)
-
-                                        if regex_match:
-                                            day = int(regex_match.group(1))
-                                            month = int(regex_match.group(2))
-                                            year = int(regex_match.group(3))
-                                            hour = int(regex_match.group(4)) if regex_match.group(4) else None
-                                            minute = int(regex_match.group(5)) if regex_match.group(5) else None
-                                            second = int(regex_match.group(6)) if regex_match.group(6) else None
-
-                                            if month > 12:
-                                                aux = day
-                                                day = month
-                                                month = aux
-
-                                            if second != None:
-                                                dt = datetime(year, month, day, hour, minute, second)
-                                                return LiquidDate(dt.strftime("%d/%m/%Y %H:%M:%S"), dt)
-                                            elif hour != None or minute != None:
-                                                dt = datetime(year, month, day, hour, minute)
-                                                return LiquidDate(dt.strftime("%d/%m/%Y %H:%M"), dt)
-                                            else:
-                                                dt = datetime(year, month, day)
-                                                return LiquidDate(dt.strftime("%d/%m/%Y"), dt)
-
-                                        return item
-                                    case _:
-                                        return item
-
-                            row_value = row.data[column_name].strip()
-                            
-                            if column.type == ColumnType.ARRAY:
-                                raw_items = [
-                                    item.strip()
-                                    for item in row_value.split(column.arrayMetadata.separator)
-                                    if item.strip()
-                                ]
-                                item_type = column.arrayMetadata.itemType
-
-                                row_variable_mapping[template_var] = [convert_item(i, item_type) for i in raw_items]
-                            else:
-                                row_variable_mapping[template_var] = convert_item(row_value, column.type)
-
-                            break
-
-            if is_docx:
-                certificate_buffer = replace_variables_in_docx_liquid(certificate_buffer, row_variable_mapping)
-            else:
-                certificate_buffer = replace_variables_in_pptx_liquid(certificate_buffer, row_variable_mapping)
-        
-        source_mime = (
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-            if is_docx
-            else "application/vnd.openxmlformats-officedocument.presentationml.presentation"
-        )
-        source_path = f"users/{user_id}/certificates/{certificate_emission_id}/certificate-{data_source_row_id}.{file_extension_str}"
-        upload_to_bucket(certificate_buffer, source_path, content_type=source_mime)
+        is_docx, _ = resolve_template_file_extension(template.fileMimeType.value)
 
-        pdf_buffer = convert_to_pdf_with_google_drive(certificate_buffer, file_extension_str)
+        print('Loading template from bucket: ', template.storageFileUrl)
+        template_plan = get_template_cached(template.storageFileUrl, is_docx, expected_generation=template_generation(template))
 
-        pdf_path = f"users/{user_id}/certificates/{certificate_emission_id}/certificate-{data_source_row_id}.pdf"
-        blob = upload_to_bucket(pdf_buffer, pdf_path)
+        print('variable_mapping: ', certificate_emission.variableColumnMapping)
+        blob = generate_certificate(certificate_emission, row, template_plan, RowConverter(certificate_emission).convert(row), is_retry)
 
         finish_certificates_generation(data_source_row_id, True, blob.size, user_id)
         
         return "", 204
         
     except ValidationError as e:
-        def format_pydantic_errors(errors):
-            formatted_errors = []
-
-            for error in errors:
-                field = ".".join([str(x) for x in error['loc']])
-                message = error['msg']
-                formatted_errors.append({
-                    "field": field,
-                    "message": message
-                })
-
-            return formatted_errors
-
         friendly_errors = format_pydantic_errors(e.errors())
 
         print("Validation errors:", friendly_errors)
@@ -795,4 +1792,34 @@ def main(request):
         return {
             'title': 'Failed to generate certificates',
             'details': details
-        }, 500
\ No newline at end of file
+        }, 500
+
+@functions_framework.http
+def export_certificates(request):
+    """On demand job: zips every PDF of an emission (or the given rows) into the bucket."""
+    raw_data = request.get_json(silent=True) or {}
+
+    try:
+        input_data = ExportCertificatesInput(**raw_data)
+    except ValidationError as e:
+        friendly_errors = format_pydantic_errors(e.errors())
+        print("Validation errors:", friendly_errors)
+        return {"error": friendly_errors}, 400
+
+    try:
+        export_blob, files_count = export_certificates_zip(
+            input_data.userId,
+            input_data.certificateEmissionId,
+            input_data.rowIds,
+        )
+    except Exception as e:
+        print('Error exporting certificates:', str(e))
+        return {
+            'title': 'Failed to export certificates',
+            'details': str(e)
+        }, 500
+
+    return {
+        "storagePath": export_blob.name,
+        "filesCount": files_count,
+    }, 200
@@ -0,0 +1,248 @@
+import json
+import os
+import select
+import shutil
+import signal
+import subprocess
+import tempfile
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from threading import Condition, Lock, current_thread, local
+
+import google.auth.transport.requests
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+
+UNO_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uno_worker.py')
+
+LIBREOFFICE_EXPORT_FILTERS = {
+    'docx': 'writer_pdf_Export',
+    'pptx': 'impress_pdf_Export',
+}
+
+
+class PdfConverter:
+    """
+    Interface of the engines that turn a rendered DOCX/PPTX into a PDF.
+    Implementations must be safe to call from several threads at once.
+    """
+
+    def convert(self, input_bytes: BytesIO, input_ext: str) -> BytesIO:
+        raise NotImplementedError
+
+
+class PdfConverterFunction(PdfConverter):
+    """Adapts a plain `(input_bytes, input_ext) -> BytesIO` function to the interface."""
+
+    def __init__(self, convert_fn):
+        self._convert_fn = convert_fn
+
+    def convert(self, input_bytes: BytesIO, input_ext: str) -> BytesIO:
+        return self._convert_fn(input_bytes, input_ext)
+
+
+class GoogleDriveClient:
+    """
+    Process-wide Drive API client.
+
+    The OAuth credentials are shared by every thread and refreshed under a lock shortly
+    before they expire. Each thread keeps its own service with its own keep-alive HTTP
+    transport (httplib2 is not thread-safe), built from the static discovery document,
+    so a conversion only costs its actual API calls. Callers are expected to run on
+    long-lived threads (see `batch_row_executor` in main.py), or each new thread pays
+    for a new service and new connections.
+    """
+
+    TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+    def __init__(self, client_id, client_secret, refresh_token, scopes, static_discovery=True,
+                 refresh_margin_seconds=300, http_timeout=120):
+        self._credentials = Credentials(
+            None,
+            refresh_token=refresh_token,
+            token_uri=self.TOKEN_URI,
+            client_id=client_id,
+            client_secret=client_secret,
+            scopes=scopes,
+        )
+        self._static_discovery = static_discovery
+        self._refresh_margin = timedelta(seconds=refresh_margin_seconds)
+        self._http_timeout = http_timeout
+        self._refresh_lock = Lock()
+        self._local = local()
+
+    def _ensure_fresh_token(self):
+        with self._refresh_lock:
+            expiry = self._credentials.expiry # naive UTC
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            if self._credentials.token and expiry and expiry - now > self._refresh_margin:
+                return
+
+            print(f"[{current_thread().name}] Refreshing Google Drive access token")
+            self._credentials.refresh(google.auth.transport.requests.Request())
+
+    def service(self):
+        self._ensure_fresh_token()
+
+        drive_service = getattr(self._local, 'service', None)
+        if drive_service is None:
+            http = AuthorizedHttp(self._credentials, http=httplib2.Http(timeout=self._http_timeout))
+            drive_service = build(
+                'drive', 'v3',
+                http=http,
+                static_discovery=self._static_discovery,
+                cache_discovery=False,
+            )
+            self._local.service = drive_service
+        return drive_service
+
+
+class LibreOfficeConversionError(Exception):
+    """Raised when soffice is up but could not convert the given document."""
+
+
+class _OfficeWorker:
+    """One uno_worker.py process, which owns one warm headless soffice."""
+
+    def __init__(self, uno_python, soffice_path, index, startup_timeout):
+        self.name = f'soffice-{os.getpid()}-{index}'
+        self.profile_dir = tempfile.mkdtemp(prefix=f'{self.name}-profile-')
+        self.process = subprocess.Popen(
+            [uno_python, UNO_WORKER_SCRIPT, soffice_path, self.name, self.profile_dir],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            start_new_session=True, # Own process group, so soffice goes down with the worker
+        )
+
+        try:
+            message = self._read_message(startup_timeout)
+            if not message.get('ready'):
+                raise RuntimeError(f'LibreOffice worker {self.name} failed to start: {message}')
+        except Exception:
+            self.close()
+            raise
+
+    def _read_message(self, timeout):
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError(f'LibreOffice worker {self.name} did not answer within {timeout}s')
+
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError(f'LibreOffice worker {self.name} exited (code {self.process.poll()})')
+        return json.loads(line)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def convert(self, input_path, output_path, filter_name, timeout):
+        job = {"input": input_path, "output": output_path, "filter": filter_name}
+        self.process.stdin.write((json.dumps(job) + '\n').encode('utf-8'))
+        self.process.stdin.flush()
+
+        message = self._read_message(timeout)
+        if not message.get('ok'):
+            raise LibreOfficeConversionError(f"LibreOffice conversion failed: {message.get('error')}")
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=15)
+        except Exception:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class LibreOfficeConverter(PdfConverter):
+    """
+    Converts locally with `soffice --headless`, with no network involved.
+
+    Keeps a pool of up to `pool_size` long-lived office processes driven through UNO, so
+    only the first conversion of each process pays LibreOffice's startup. Processes are
+    started lazily, reused across requests and replaced when they die or time out.
+    """
+
+    def __init__(self, soffice_path, pool_size=2, uno_python='/usr/bin/python3', timeout=120, startup_timeout=60):
+        self.soffice_path = soffice_path
+        self.pool_size = pool_size
+        self.uno_python = uno_python
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+
+        # Guards both the idle workers and the started count, so a waiter wakes up both
+        # when a worker is handed back and when a dead one frees its slot
+        self._idle = []
+        self._capacity = Condition()
+        self._started = 0
+        self._next_index = 0
+
+    def _acquire(self) -> _OfficeWorker:
+        with self._capacity:
+            while not self._idle and self._started >= self.pool_size:
+                self._capacity.wait()
+
+            if self._idle:
+                return self._idle.pop()
+
+            self._started += 1
+            index = self._next_index
+            self._next_index += 1
+
+        try:
+            print(f"[{current_thread().name}] Starting LibreOffice worker {index}")
+            return _OfficeWorker(self.uno_python, self.soffice_path, index, self.startup_timeout)
+        except Exception:
+            self._free_slot()
+            raise
+
+    def _free_slot(self):
+        with self._capacity:
+            self._started -= 1
+            self._capacity.notify()
+
+    def _release(self, worker: _OfficeWorker, healthy: bool):
+        if healthy and worker.is_alive():
+            with self._capacity:
+                self._idle.append(worker)
+                self._capacity.notify()
+            return
+
+        worker.close()
+        # A waiter can now start a replacement
+        self._free_slot()
+
+    def convert(self, input_bytes: BytesIO, input_ext: str) -> BytesIO:
+        filter_name = LIBREOFFICE_EXPORT_FILTERS.get(input_ext)
+        if not filter_name:
+            raise ValueError(f"Unsupported file extension: {input_ext}")
+
+        with tempfile.TemporaryDirectory(prefix='certificate-') as tmp_dir:
+            input_path = os.path.join(tmp_dir, f'certificate.{input_ext}')
+            output_path = os.path.join(tmp_dir, 'certificate.pdf')
+
+            with open(input_path, 'wb') as f:
+                f.write(input_bytes.getbuffer())
+
+            worker = self._acquire()
+            try:
+                worker.convert(input_path, output_path, filter_name, self.timeout)
+            except LibreOfficeConversionError:
+                # The worker answered, only this document failed: keep it warm
+                self._release(worker, healthy=True)
+                raise
+            except BaseException:
+                # Timed out or died: it may still be busy with this job, never reuse it
+                self._release(worker, healthy=False)
+                raise
+            self._release(worker, healthy=True)
+
+            with open(output_path, 'rb') as f:
+                pdf_buffer = BytesIO(f.read())
+
+        pdf_buffer.seek(0)
+        return pdf_buffer
@@ -0,0 +1,106 @@
+"""
+Long-lived LibreOffice conversion worker.
+
+This script is NOT imported by the function. It is executed by LibreOffice's Python
+(the interpreter that can `import uno`, e.g. /usr/bin/python3 with python3-uno) and
+started by LibreOfficeConverter in pdf_converters.py.
+
+It boots one headless soffice listening on a private pipe, connects to it through UNO
+and then converts documents on demand. Protocol (one JSON object per line):
+
+    stdin:  {"input": "/tmp/in.docx", "output": "/tmp/out.pdf", "filter": "writer_pdf_Export"}
+    stdout: {"ok": true} | {"ok": false, "error": "..."}
+
+A {"ready": true} line is written once soffice accepts connections. Nothing else may
+be written to stdout.
+"""
+import json
+import subprocess
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+STARTUP_TIMEOUT_SECONDS = 60
+
+
+def reply(message):
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+
+def props(**kwargs):
+    values = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        values.append(prop)
+    return tuple(values)
+
+
+def connect(pipe_name):
+    local_ctx = uno.getComponentContext()
+    resolver = local_ctx.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local_ctx)
+
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while True:
+        try:
+            ctx = resolver.resolve(f'uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext')
+            return ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+        except NoConnectException:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.25)
+
+
+def main():
+    soffice_path, pipe_name, profile_dir = sys.argv[1:4]
+
+    office = subprocess.Popen([
+        soffice_path,
+        '--headless', '--invisible', '--nologo', '--norestore', '--nodefault', '--nolockcheck',
+        f'--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext',
+        f'-env:UserInstallation={uno.systemPathToFileUrl(profile_dir)}',
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    desktop = None
+    try:
+        desktop = connect(pipe_name)
+        reply({"ready": True})
+
+        for line in sys.stdin:
+            job = json.loads(line)
+            try:
+                document = desktop.loadComponentFromURL(
+                    uno.systemPathToFileUrl(job['input']), '_blank', 0, props(Hidden=True, ReadOnly=True)
+                )
+                if document is None:
+                    raise RuntimeError('LibreOffice could not load the document')
+                try:
+                    document.storeToURL(uno.systemPathToFileUrl(job['output']), props(FilterName=job['filter']))
+                finally:
+                    document.close(True)
+                reply({"ok": True})
+            except Exception as e:
+                reply({"ok": False, "error": str(e)})
+                # A dead office process cannot serve further jobs, let the pool replace us
+                if office.poll() is not None:
+                    break
+    finally:
+        try:
+            if desktop is not None:
+                desktop.terminate()
+        except Exception:
+            pass
+        office.terminate()
+        try:
+            office.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            office.kill()
+
+
+if __name__ == '__main__':
+    main()
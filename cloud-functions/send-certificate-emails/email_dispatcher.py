@@ -0,0 +1,188 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Lock, Semaphore, Thread
+
+
+class RateLimitedError(Exception):
+    """Raised by a send function when the provider answered 429 Too Many Requests."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after # seconds, if the provider said so
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills `rate` tokens per second and banks up to
+    `capacity` of them. The rate can be changed at runtime and the bucket paused.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0
+        self._lock = Lock()
+
+    def _refill(self, now):
+        if now > self._updated_at:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def pause(self, seconds):
+        """No token is handed out for `seconds`, and nothing is banked meanwhile."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._updated_at = self._paused_until
+
+
+class EmailDispatcher:
+    """
+    Runs a blocking `send_fn(item)` over the items of each dispatch, with at most
+    `max_concurrency` calls in flight per dispatch and at most `rate_per_second` calls
+    started per second. The token bucket is shared by every dispatch of the process,
+    since the provider quota is per account and not per request.
+
+    When `send_fn` raises RateLimitedError, every sender pauses for the provider's
+    retry-after (or an exponential backoff) and the rate is halved. Each success then
+    gives back a little of it, up to `rate_per_second`. The rate-limited item is tried
+    again, up to `max_rate_limit_retries` times. Any other exception fails just that item.
+    """
+
+    def __init__(self, max_concurrency=10, rate_per_second=10, burst=None, min_rate_per_second=0.5,
+                 max_rate_limit_retries=5, base_backoff_seconds=1, max_backoff_seconds=60):
+        self.max_concurrency = max_concurrency
+        self.rate_per_second = rate_per_second
+        self.min_rate_per_second = min(min_rate_per_second, rate_per_second)
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self._rate = rate_per_second
+        self._rate_lock = Lock()
+        self._slowed_until = 0
+        self._bucket = TokenBucket(rate_per_second, burst or rate_per_second)
+
+    def _on_rate_limited(self, retry_after, attempt):
+        if retry_after is None:
+            retry_after = min(self.max_backoff_seconds, self.base_backoff_seconds * 2 ** (attempt - 1))
+        # Jitter, so the paused senders do not all hit the provider in the same instant
+        delay = retry_after + random.uniform(0, self.base_backoff_seconds)
+
+        with self._rate_lock:
+            # Senders already in flight also get 429s for the same overflow: slow down once
+            now = time.monotonic()
+            if now >= self._slowed_until:
+                self._rate = max(self.min_rate_per_second, self._rate / 2)
+                self._bucket.set_rate(self._rate)
+            self._slowed_until = max(self._slowed_until, now + delay)
+            rate = self._rate
+
+        print(f"Rate limited by the email provider, pausing {delay:.1f}s and slowing down to {rate:.2f} emails/s")
+        self._bucket.pause(delay)
+
+    def _on_success(self):
+        with self._rate_lock:
+            if self._rate < self.rate_per_second:
+                self._rate = min(self.rate_per_second, self._rate + self.rate_per_second / 20)
+                self._bucket.set_rate(self._rate)
+
+    def _send(self, send_fn, args):
+        attempt = 0
+        while True:
+            self._bucket.acquire()
+            attempt += 1
+            try:
+                send_fn(*args)
+            except RateLimitedError as e:
+                if attempt > self.max_rate_limit_retries:
+                    return {"success": False, "error": str(e), "attempts": attempt}
+                self._on_rate_limited(e.retry_after, attempt)
+                continue
+            except Exception as e:
+                return {"success": False, "error": str(e), "attempts": attempt}
+
+            self._on_success()
+            return {"success": True, "error": None, "attempts": attempt}
+
+    def dispatch(self, send_fn, items, prepare_fn=None, prepare_concurrency=4, prefetch_depth=None):
+        """
+        Returns one `{success, error, attempts}` result per item, in the items' order.
+
+        With `prepare_fn` (e.g. downloading an attachment), items go through two stages:
+        `prepare_concurrency` threads run `prepare_fn(item)` ahead of the senders and
+        hand the result over a bounded queue, and senders call `send_fn(item, prepared)`.
+        At most `prefetch_depth` items are prepared or being prepared and not yet picked
+        up by a sender, which caps the memory held. An item whose preparation raised is
+        failed with `attempts` 0.
+        """
+        if not items:
+            return []
+
+        max_workers = min(self.max_concurrency, len(items))
+
+        if prepare_fn is None:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='email') as executor:
+                return list(executor.map(lambda item: self._send(send_fn, (item,)), items))
+
+        results = [None] * len(items)
+        prepared_queue = Queue()
+        free_slots = Semaphore(prefetch_depth or 2 * max_workers)
+
+        def produce(prepare_executor):
+            for index, item in enumerate(items):
+                free_slots.acquire()
+                prepared_queue.put((index, item, prepare_executor.submit(prepare_fn, item)))
+            for _ in range(max_workers):
+                prepared_queue.put(None)
+
+        def consume():
+            while True:
+                job = prepared_queue.get()
+                if job is None:
+                    return
+
+                index, item, prepared_future = job
+                try:
+                    prepared = prepared_future.result()
+                except Exception as e:
+                    results[index] = {"success": False, "error": str(e), "attempts": 0}
+                    continue
+                finally:
+                    free_slots.release()
+
+                results[index] = self._send(send_fn, (item, prepared))
+
+        with ThreadPoolExecutor(max_workers=prepare_concurrency, thread_name_prefix='email-prepare') as prepare_executor, \
+                ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='email') as send_executor:
+            producer = Thread(target=produce, args=(prepare_executor,), name='email-producer', daemon=True)
+            producer.start()
+            senders = [send_executor.submit(consume) for _ in range(max_workers)]
+            for sender in senders:
+                sender.result()
+            producer.join()
+
+        return results
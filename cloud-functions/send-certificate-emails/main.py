@@ -1,15 +1,15 @@
 import base64
+import html
 import os
-from concurrent.futures import ThreadPoolExecutor
+import re
 from google.cloud import storage
-import requests
 import functions_framework
 from dotenv import load_dotenv
-from google.auth.transport.requests import Request
-from google.oauth2.id_token import fetch_id_token
+from backend_client import BackendClient
+from email_dispatcher import EmailDispatcher, RateLimitedError
 from datetime import date
 from pydantic import BaseModel, ValidationError
-from typing import List
+from typing import Dict, List, Optional
 import resend
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
@@ -22,6 +22,14 @@ ENV = os.getenv('ENV', 'production')
 APP_BASE_URL = os.getenv('APP_BASE_URL')
 AUDIENCE = os.getenv("TOKEN_AUDIENCE", APP_BASE_URL) # For local environments
 CERTIFICATES_BUCKET = os.getenv('CERTIFICATES_BUCKET')
+EMAIL_MAX_CONCURRENCY = int(os.getenv('EMAIL_MAX_CONCURRENCY', '10'))
+BREVO_RATE_LIMIT_PER_SECOND = float(os.getenv('BREVO_RATE_LIMIT_PER_SECOND', '10'))
+BREVO_RATE_LIMIT_BURST = int(os.getenv('BREVO_RATE_LIMIT_BURST', '0')) or None # Defaults to one second worth of sends
+BREVO_MAX_RATE_LIMIT_RETRIES = int(os.getenv('BREVO_MAX_RATE_LIMIT_RETRIES', '5'))
+EMAIL_DOWNLOAD_CONCURRENCY = int(os.getenv('EMAIL_DOWNLOAD_CONCURRENCY', '8'))
+EMAIL_PREFETCH_DEPTH = int(os.getenv('EMAIL_PREFETCH_DEPTH', str(2 * EMAIL_MAX_CONCURRENCY))) # Attachments downloaded ahead of the senders
+BREVO_BATCH_SIZE = int(os.getenv('BREVO_BATCH_SIZE', '50')) # Recipients per messageVersions call, 1 sends one by one
+BREVO_POOL_MAXSIZE = int(os.getenv('BREVO_POOL_MAXSIZE', str(EMAIL_MAX_CONCURRENCY))) # Keep-alive connections to the Brevo API
 
 for var_name, var_value in {
     "APP_BASE_URL": APP_BASE_URL,
@@ -33,11 +41,24 @@ for var_name, var_value in {
 
 brevo_configuration = sib_api_v3_sdk.Configuration()
 brevo_configuration.api_key['api-key'] = BREVO_API_KEY
+brevo_configuration.connection_pool_maxsize = BREVO_POOL_MAXSIZE
+# One client for every recipient and warm invocation: its urllib3 pool is thread-safe,
+# so sends reuse a few TLS connections instead of a handshake each
+brevo_api_client = sib_api_v3_sdk.ApiClient(brevo_configuration)
+transactional_emails_api = sib_api_v3_sdk.TransactionalEmailsApi(brevo_api_client)
 storage_client = storage.Client()
+backend_client = BackendClient(APP_BASE_URL, AUDIENCE, use_id_token=ENV != 'local')
+email_dispatcher = EmailDispatcher(
+    max_concurrency=EMAIL_MAX_CONCURRENCY,
+    rate_per_second=BREVO_RATE_LIMIT_PER_SECOND,
+    burst=BREVO_RATE_LIMIT_BURST,
+    max_rate_limit_retries=BREVO_MAX_RATE_LIMIT_RETRIES,
+)
 
 class RecipientModel(BaseModel):
     rowId: str
     email: str
+    variables: Optional[Dict[str, str]] = None # Values for the {{ name }} placeholders of the body
 
 class SendCertificateEmailsInput(BaseModel):
     certificateEmissionId: str
@@ -52,26 +73,133 @@ def get_from_bucket(file_path):
     blob = bucket.blob(file_path)
     return blob.download_as_bytes()
 
+def certificate_path(user_id, certificate_emission_id, row_id):
+    return f"users/{user_id}/certificates/{certificate_emission_id}/certificate-{row_id}.pdf"
+
+def list_certificate_md5s(user_id, certificate_emission_id) -> Dict[str, str]:
+    """{rowId: md5 of its PDF} for the emission, from a single listing of the bucket."""
+    prefix = f"users/{user_id}/certificates/{certificate_emission_id}/certificate-"
+    md5s = {}
+    for blob in storage_client.list_blobs(CERTIFICATES_BUCKET, prefix=prefix):
+        if blob.name.endswith('.pdf') and blob.md5_hash:
+            md5s[blob.name[len(prefix):-len('.pdf')]] = blob.md5_hash
+    return md5s
+
+def batch_recipients(recipients: List[RecipientModel], pdf_md5s: Dict[str, str], batch_size, content_key=lambda recipient: None) -> List[List[RecipientModel]]:
+    """
+    Groups the recipients that get byte-identical PDFs (e.g. a template without
+    variables) and the same `content_key` into batches of up to `batch_size`. Brevo's
+    messageVersions can vary the recipients of a call but not its attachment, so every
+    other recipient is sent alone.
+    """
+    groups = {}
+    batches = []
+    for recipient in recipients:
+        md5 = pdf_md5s.get(recipient.rowId)
+        if md5 is None:
+            batches.append([recipient])
+            continue
+
+        group_key = (md5, content_key(recipient))
+        group = groups.get(group_key)
+        if group is None or len(group) >= batch_size:
+            group = groups[group_key] = []
+            batches.append(group)
+        group.append(recipient)
+    return batches
+
+
+def brevo_retry_after(e: ApiException):
+    """Seconds until the Brevo quota resets, from the headers of a 429, if present."""
+    headers = e.headers or {}
+    for header in ('x-sib-ratelimit-reset', 'Retry-After'):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+    return None
+
+def build_email_html(body_html):
+    return f"""
+    <html>
+        <body style="font-family: sans-serif; color: #333;">
+            <p style="white-space: pre-line;">{body_html}</p>
+            <br>
+            
+            <div style="background-color: #26272B; padding: .75rem 1rem; max-width: 39rem; border-radius: .75rem; font-family: 'Segoe UI', Roboto, Helvetica, Arial, sans-serif; font-size: .75rem;">
+                <div style="background-color: #18191E; padding: 1rem 1rem; border-radius: .75rem; border: 2px solid #4A4A52; text-align: center;">
+                    <div style="font-size: 1rem; font-weight: 600; color: white;">
+                        <img src="{APP_BASE_URL}/logo.png" alt="Certifica" style="width: 1.5rem; height: 1.5rem; vertical-align: middle;">
+                        <span style="vertical-align: middle;">
+                            Certifica
+                        </span>
+                    </div>
+                    <p style="color: #a1a1aa; text-align: center; margin: .5rem;">
+                        Este email foi enviado pela<br>plataforma de gerenciamento de certificados.
+                    </p>
+                    <p style="margin: 0; color: #71717a; text-align: center;">
+                        <a href="{APP_BASE_URL}" target="_blank"
+                            style="color: #2563eb; text-decoration: underline;">Certifica</a>
+                        <span style="margin: 0 8px; color: #52525b;">|</span>
+                        <span>© {date.today().year}</span>
+                    </p>
+                </div>
+            </div>
+        </body>
+    </html>
+    """
+
+# Splits the job's body at its {{ name }} placeholders, see EmailContent
+PLACEHOLDER_REGEX = re.compile(r"\{\{\s*([A-Za-z_][\w.-]*)\s*\}\}")
+BODY_MARKER = "\x00body\x00"
+
+class EmailContent:
+    """
+    HTML and text bodies of a job, built once per SendCertificateEmailsInput.
+
+    The body may use `{{ name }}` placeholders, filled per recipient from
+    RecipientModel.variables (escaped in the HTML, missing names render empty). A
+    recipient without variables gets the body as written. The placeholders are parsed
+    once, so a recipient only costs a join of the pieces.
+    """
+
+    def __init__(self, body):
+        # Literals at even indexes, placeholder names at odd ones
+        self.body_parts = PLACEHOLDER_REGEX.split(body)
+        self.variable_names = self.body_parts[1::2]
+        self.html_prefix, self.html_suffix = build_email_html(BODY_MARKER).split(BODY_MARKER)
+        self.html = self.html_prefix + body + self.html_suffix
+        self.text = body
+
+    def key(self, variables: Optional[Dict[str, str]]):
+        """Recipients with the same key get the same bodies."""
+        if not self.variable_names or variables is None:
+            return None
+        return tuple(variables.get(name, "") for name in self.variable_names)
+
+    def render(self, variables: Optional[Dict[str, str]]):
+        """Returns (html, text) for a recipient."""
+        if not self.variable_names or variables is None:
+            return self.html, self.text
+
+        text_parts = []
+        html_parts = [self.html_prefix]
+        for index, part in enumerate(self.body_parts):
+            if index % 2:
+                value = variables.get(part, "")
+                text_parts.append(value)
+                html_parts.append(html.escape(value))
+            else:
+                text_parts.append(part)
+                html_parts.append(part)
+        html_parts.append(self.html_suffix)
+        return "".join(html_parts), "".join(text_parts)
 
 def update_email_status(email_id, status, user_id=None, emails_sent_count=None):
     print('Inside update')
-    url = f"{APP_BASE_URL}/api/internal/emails/{email_id}"
-
-
-    if ENV != 'local':
-        auth_req = Request()
-
-        id_token = fetch_id_token(auth_req, AUDIENCE)
-
-        headers = {
-            "Authorization": f"Bearer {id_token}",
-            "Content-Type": "application/json",
-        }
-    else:
-        headers = {
-            "Content-Type": "application/json",
-        }
-    
     body = {
         "status": status,
     }
@@ -83,8 +211,7 @@ def update_email_status(email_id, status, user_id=None, emails_sent_count=None):
         body["emailsSentCount"] = emails_sent_count
 
     print('before sending patch')
-    response = requests.patch(url, json=body, headers=headers)
-    response.raise_for_status()
+    backend_client.patch(f"/api/internal/emails/{email_id}", body)
 
 @functions_framework.http
 def main(request):
@@ -99,85 +226,82 @@ def main(request):
         email_id = input_data.emailId
         user_id = input_data.userId
         subject = input_data.subject
-        body = input_data.body
         recipients = input_data.recipients
+        email_content = EmailContent(input_data.body)
 
-        def send_email_to_recipient(recipient_data: RecipientModel):
-            row_id = recipient_data.rowId
-            recipient = recipient_data.email
-            path = f"users/{user_id}/certificates/{certificate_emission_id}/certificate-{row_id}.pdf"
-            pdf_bytes = get_from_bucket(path)
-
-            html_content = f"""
-            <html>
-                <body style="font-family: sans-serif; color: #333;">
-                    <p style="white-space: pre-line;">{body}</p>
-                    <br>
-                    
-                    <div style="background-color: #26272B; padding: .75rem 1rem; max-width: 39rem; border-radius: .75rem; font-family: 'Segoe UI', Roboto, Helvetica, Arial, sans-serif; font-size: .75rem;">
-                        <div style="background-color: #18191E; padding: 1rem 1rem; border-radius: .75rem; border: 2px solid #4A4A52; text-align: center;">
-                            <div style="font-size: 1rem; font-weight: 600; color: white;">
-                                <img src="{APP_BASE_URL}/logo.png" alt="Certifica" style="width: 1.5rem; height: 1.5rem; vertical-align: middle;">
-                                <span style="vertical-align: middle;">
-                                    Certifica
-                                </span>
-                            </div>
-                            <p style="color: #a1a1aa; text-align: center; margin: .5rem;">
-                                Este email foi enviado pela<br>plataforma de gerenciamento de certificados.
-                            </p>
-                            <p style="margin: 0; color: #71717a; text-align: center;">
-                                <a href="{APP_BASE_URL}" target="_blank"
-                                    style="color: #2563eb; text-decoration: underline;">Certifica</a>
-                                <span style="margin: 0 8px; color: #52525b;">|</span>
-                                <span>© {date.today().year}</span>
-                            </p>
-                        </div>
-                    </div>
-                </body>
-            </html>
-            """
+        def download_attachment(batch: List[RecipientModel]) -> str:
+            # Every recipient of a batch gets the same PDF, so any of them can be downloaded
+            pdf_bytes = get_from_bucket(certificate_path(user_id, certificate_emission_id, batch[0].rowId))
+            return base64.b64encode(pdf_bytes).decode("utf-8")
 
-            try:
-                print(f"Sending email to {recipient} via Brevo...")
-                api_client = sib_api_v3_sdk.ApiClient(brevo_configuration)
-                api = sib_api_v3_sdk.TransactionalEmailsApi(api_client)
+        def send_email_to_recipients(batch: List[RecipientModel], attachment_content: str):
+            # Recipients of a batch share the content key, so the first one renders for all
+            html_content, text_content = email_content.render(batch[0].variables)
 
+            if len(batch) == 1:
+                print(f"Sending email to {batch[0].email} via Brevo...")
+                recipients_fields = {"to": [{"email": batch[0].email}]}
+            else:
+                print(f"Sending email to {len(batch)} recipients via Brevo...")
+                recipients_fields = {"message_versions": [{"to": [{"email": recipient.email}]} for recipient in batch]}
+
+            try:
                 send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
                     sender={
                         "name": "Certifica",
                         "email": "nao-responda@mail.certifica.felyppe.com.br"
                     },
-                    to=[{"email": recipient}],
                     subject=subject,
                     html_content=html_content,
-                    text_content=body,
+                    text_content=text_content,
                     attachment=[{
                         "name": "certificado.pdf",
-                        "content": base64.b64encode(pdf_bytes).decode("utf-8")
-                    }]
+                        "content": attachment_content
+                    }],
+                    **recipients_fields
                 )
 
-                response = api.send_transac_email(send_smtp_email)
-                print(f"Enviado com sucesso! Message ID: {response.message_id}")
-                return True
+                response = transactional_emails_api.send_transac_email(send_smtp_email)
             except ApiException as e:
-                print(f"Erro ao enviar e-mail via Brevo: {e}")
-                return False
-            except Exception as e:
-                print(f"Erro ao enviar e-mail: {e}")
-                return False
-
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [
-                executor.submit(send_email_to_recipient, recipient_data)
-                for recipient_data in recipients
-            ]
-
-            # Wait for all to complete
-            for f in futures:
-                f.result()
-
-        update_email_status(email_id, 'COMPLETED', user_id, len(recipients))
+                if e.status == 429:
+                    raise RateLimitedError(f"Brevo rate limit reached: {e.reason}", brevo_retry_after(e))
+                raise
+            print(f"Enviado com sucesso! Message ID: {response.message_id or response.message_ids}")
+
+        pdf_md5s = {}
+        if BREVO_BATCH_SIZE > 1 and len(recipients) > 1:
+            pdf_md5s = list_certificate_md5s(user_id, certificate_emission_id)
+        batches = batch_recipients(
+            recipients, pdf_md5s, BREVO_BATCH_SIZE,
+            content_key=lambda recipient: email_content.key(recipient.variables),
+        )
+        print(f"Sending {len(recipients)} emails in {len(batches)} Brevo calls")
+
+        # A batch is one API call, it succeeds or fails for all of its recipients
+        results = email_dispatcher.dispatch(
+            send_email_to_recipients,
+            batches,
+            prepare_fn=download_attachment,
+            prepare_concurrency=EMAIL_DOWNLOAD_CONCURRENCY,
+            prefetch_depth=EMAIL_PREFETCH_DEPTH,
+        )
+        recipient_results = [
+            {"rowId": recipient_data.rowId, "email": recipient_data.email, **result}
+            for batch, result in zip(batches, results)
+            for recipient_data in batch
+        ]
+
+        failed_results = [result for result in recipient_results if not result["success"]]
+        emails_sent_count = len(recipient_results) - len(failed_results)
+        print(f"Emails sent: {emails_sent_count} succeeded, {len(failed_results)} failed")
+        for result in failed_results:
+            print(f"Erro ao enviar e-mail para {result['email']} (row {result['rowId']}): {result['error']}")
+
+        if recipients and emails_sent_count == 0:
+            # Reported as FAILED by the handler below
+            raise RuntimeError(f"No certificate email could be sent: {failed_results[0]['error']}")
+
+        update_email_status(email_id, 'COMPLETED', user_id, emails_sent_count)
 
         return "", 204
     
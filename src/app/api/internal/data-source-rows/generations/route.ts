@@ -0,0 +1,110 @@
+import { prisma } from '@/backend/infrastructure/repository/prisma'
+import { NextRequest, NextResponse } from 'next/server'
+import { handleError, HandleErrorResponse } from '@/app/api/_utils/handle-error'
+import { AppError } from '@/backend/domain/error/app-error'
+import z from 'zod'
+import { sseBroker } from '@/backend/infrastructure/sse'
+import { validateServiceAccountToken } from '@/app/api/_middleware/validateServiceAccountToken'
+import { FinishCertificatesGenerationUseCase } from '@/backend/application/finish-certificates-generation-use-case'
+import { PrismaDataSourceRowsRepository } from '@/backend/interface-adapters/repository/prisma/write/prisma-data-source-rows-repository'
+import { PrismaTransactionManager } from '@/backend/interface-adapters/repository/prisma/prisma-transaction-manager'
+import { PrismaCertificatesRepository } from '@/backend/interface-adapters/repository/prisma/write/prisma-certificates-repository'
+import { PrismaUsersRepository } from '@/backend/interface-adapters/repository/prisma/write/prisma-users-repository'
+
+const finishCertificatesGenerationsSchema = z.object({
+    generations: z
+        .array(
+            z.object({
+                dataSourceRowId: z.string(),
+                success: z.boolean(),
+                totalBytes: z.number().optional(),
+                userId: z.string().optional(),
+            }),
+        )
+        .min(1),
+})
+
+interface FinishCertificatesGenerationsResponse {
+    results: {
+        dataSourceRowId: string
+        success: boolean
+        error?: string
+        retryable?: boolean
+    }[]
+}
+
+// Bulk version of PATCH /api/internal/data-source-rows/[dataSourceRowId]/generations,
+// used by generate-pdfs to report many rows at once. Each row is finished on
+// its own, so one failing row does not prevent the others from being recorded.
+// A failed row is `retryable` unless it failed with an AppError, which the
+// per-row route would answer with a 4xx too.
+export async function POST(
+    request: NextRequest,
+): Promise<
+    NextResponse<FinishCertificatesGenerationsResponse | HandleErrorResponse>
+> {
+    try {
+        await validateServiceAccountToken(request)
+
+        const body = await request.json()
+        const parsed = finishCertificatesGenerationsSchema.parse(body)
+
+        const dataSourceRowsRepository = new PrismaDataSourceRowsRepository(
+            prisma,
+        )
+        const certificateEmissionsRepository = new PrismaCertificatesRepository(
+            prisma,
+        )
+        const usersRepository = new PrismaUsersRepository(prisma)
+        const transactionManager = new PrismaTransactionManager(prisma)
+
+        const finishCertificatesGenerationUseCase =
+            new FinishCertificatesGenerationUseCase(
+                dataSourceRowsRepository,
+                certificateEmissionsRepository,
+                usersRepository,
+                transactionManager,
+            )
+
+        const results: FinishCertificatesGenerationsResponse['results'] = []
+
+        for (const generation of parsed.generations) {
+            try {
+                const { certificateEmissionId } =
+                    await finishCertificatesGenerationUseCase.execute({
+                        dataSourceRowId: generation.dataSourceRowId,
+                        success: generation.success,
+                        totalBytes: generation.totalBytes,
+                        userId: generation.userId,
+                    })
+
+                sseBroker.sendEvent(certificateEmissionId, {
+                    type: 'row-completed',
+                    dataSourceRowId: generation.dataSourceRowId,
+                    success: generation.success,
+                })
+
+                results.push({
+                    dataSourceRowId: generation.dataSourceRowId,
+                    success: true,
+                })
+            } catch (error: unknown) {
+                console.error(error)
+
+                results.push({
+                    dataSourceRowId: generation.dataSourceRowId,
+                    success: false,
+                    error:
+                        error instanceof Error
+                            ? error.message
+                            : 'Unknown error',
+                    retryable: !(error instanceof AppError),
+                })
+            }
+        }
+
+        return NextResponse.json({ results }, { status: 200 })
+    } catch (error: unknown) {
+        return await handleError(error)
+    }
+}
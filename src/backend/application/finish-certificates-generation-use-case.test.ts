@@ -7,15 +7,19 @@ import { ITransactionManager } from './interfaces/repository/itransaction-manage
 import { DataSourceRowNotFoundError } from '../domain/error/not-found-error/data-source-row-not-found-error'
 import { CertificateNotFoundError } from '../domain/error/not-found-error/certificate-not-found-error'
 import { FileBytesMissingError } from '../domain/error/validation-error/file-bytes-missing-error'
+import { PROCESSING_STATUS_ENUM } from '../domain/data-source-row'
 
 describe('FinishCertificatesGenerationUseCase', () => {
     const CERTIFICATE_ID = 'cert-1'
     const ROW_ID = 'row-1'
 
-    function createDataSourceRowMock() {
+    function createDataSourceRowMock(
+        processingStatus = PROCESSING_STATUS_ENUM.RUNNING,
+    ) {
         return {
             finishGenerationSuccessfully: vi.fn(),
             finishGenerationWithError: vi.fn(),
+            getProcessingStatus: vi.fn().mockReturnValue(processingStatus),
             serialize: vi
                 .fn()
                 .mockReturnValue({ certificateEmissionId: CERTIFICATE_ID }),
@@ -150,6 +154,27 @@ describe('FinishCertificatesGenerationUseCase', () => {
         )
     })
 
+    it('deve não registrar uso de novo quando a linha já estava concluída', async () => {
+        const rowMock = createDataSourceRowMock(
+            PROCESSING_STATUS_ENUM.COMPLETED,
+        )
+        dataSourceRowsRepository.getById.mockResolvedValue(rowMock as any)
+        certificatesRepository.checkIfExistsById.mockResolvedValue(true)
+        dataSourceRowsRepository.allRowsFinishedProcessing.mockResolvedValue(
+            false,
+        )
+
+        await makeUseCase().execute({
+            dataSourceRowId: ROW_ID,
+            success: true,
+            totalBytes: 512,
+            userId: 'user-1',
+        })
+
+        expect(rowMock.finishGenerationSuccessfully).toHaveBeenCalledWith(512)
+        expect(usersRepository.upsertDailyUsage).not.toHaveBeenCalled()
+    })
+
     it('deve não registrar uso quando userId não for informado', async () => {
         const rowMock = createDataSourceRowMock()
         dataSourceRowsRepository.getById.mockResolvedValue(rowMock as any)
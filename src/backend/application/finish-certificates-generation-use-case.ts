@@ -5,6 +5,7 @@ import { IDataSourceRowsRepository } from './interfaces/repository/write/idata-s
 import { ICertificatesRepository } from './interfaces/repository/write/icertificates-repository'
 import { IUsersRepository } from './interfaces/repository/write/iusers-repository'
 import { ITransactionManager } from './interfaces/repository/itransaction-manager'
+import { PROCESSING_STATUS_ENUM } from '../domain/data-source-row'
 
 interface FinishCertificatesGenerationUseCaseInput {
     dataSourceRowId: string
@@ -36,6 +37,13 @@ export class FinishCertificatesGenerationUseCase {
             throw new DataSourceRowNotFoundError()
         }
 
+        // Cloud Tasks retries a whole batch when one of its rows fails, so rows
+        // that already succeeded are reported again. They must count towards
+        // usage only once.
+        const wasAlreadyCompleted =
+            dataSourceRow.getProcessingStatus() ===
+            PROCESSING_STATUS_ENUM.COMPLETED
+
         if (input.success) {
             if (!input.totalBytes) {
                 throw new FileBytesMissingError()
@@ -60,7 +68,7 @@ export class FinishCertificatesGenerationUseCase {
 
         await this.dataSourceRowsRepository.update(dataSourceRow)
 
-        if (input.success && input.userId) {
+        if (input.success && input.userId && !wasAlreadyCompleted) {
             await this.usersRepository.upsertDailyUsage(input.userId, {
                 certificatesGeneratedCount: 1,
             })
@@ -11,6 +11,7 @@ data "archive_file" "generate_certificates_zip" {
     ".pytest_cache",
     "venv",
     ".venv",
+    "benchmarks",
   ]
 }
 
@@ -49,7 +50,7 @@ resource "google_cloudfunctions2_function" "generate_certificates_function" {
   service_config {
     max_instance_count = 10
     min_instance_count = 0
-    max_instance_request_concurrency = 6
+    max_instance_request_concurrency = local.generate_pdfs_request_concurrency
     available_memory   = "512M"
     timeout_seconds    = 240
     available_cpu = "1"
@@ -63,6 +64,49 @@ resource "google_cloudfunctions2_function" "generate_certificates_function" {
       GOOGLE_CLIENT_ID = var.google_client_id
       GOOGLE_CLIENT_SECRET = var.google_client_secret
       MAX_ATTEMPTS = tostring(local.generate_pdfs_max_attempts)
+      REQUEST_CONCURRENCY = tostring(local.generate_pdfs_request_concurrency)
+    }
+
+    service_account_email = google_service_account.app_service_account.email
+  }
+
+  depends_on = [ google_project_iam_member.sa_roles_runner ]
+}
+
+# Same source as generate-certificates, on demand: zips the PDFs of an emission in the bucket
+resource "google_cloudfunctions2_function" "export_certificates_function" {
+  name     = "export-certificates${local.suffix}"
+  location = var.region
+
+  build_config {
+    runtime     = "python312"
+    entry_point = "export_certificates"
+
+    source {
+      storage_source {
+        bucket = google_storage_bucket.cloud_functions.name
+        object = google_storage_bucket_object.generate_certificates_object.name
+      }
+    }
+
+    service_account = google_service_account.app_service_account.id
+  }
+
+  service_config {
+    max_instance_count = 5
+    min_instance_count = 0
+    max_instance_request_concurrency = 2
+    available_memory   = "512M"
+    timeout_seconds    = 540
+    available_cpu = "1"
+
+    environment_variables = {
+      APP_BASE_URL        = "https://${google_cloud_run_v2_service.app.name}-${data.google_project.project.number}.${var.region}.run.app"
+      CERTIFICATES_BUCKET = google_storage_bucket.certificates.name
+      GOOGLE_DRIVE_FOLDER_ID = var.google_drive_folder_id
+      GOOGLE_REFRESH_TOKEN = var.google_refresh_token
+      GOOGLE_CLIENT_ID = var.google_client_id
+      GOOGLE_CLIENT_SECRET = var.google_client_secret
     }
 
     service_account_email = google_service_account.app_service_account.email
@@ -3,6 +3,7 @@ locals {
   project_id_hash = substr(md5(var.project_id), 0, 8)
   pubsub_service_account = "service-${data.google_project.project.number}@gcp-sa-pubsub.iam.gserviceaccount.com" # Internally managed by Google
   generate_pdfs_max_attempts = 50 # To keep queue's retry config and function value in sync
+  generate_pdfs_request_concurrency = 6 # Sizes the function's per-instance thread pools too
 }
 
 variable "project_id" {